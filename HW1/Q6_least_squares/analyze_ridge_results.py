@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
@@ -40,3 +41,65 @@ def analyze_results(ridge_obj, cutoff):
             "call_fracs": call_fracs,
             "y_vals": y_vals,
             "loss_01": loss_01, "loss_01_norm": loss_01_norm}
+
+
+def threshold_sweep(y_preds, truth):
+    """
+    Confusion counts, 0/1 loss and ROC/PR points for every threshold at
+    once.  A point is called positive when its prediction is > threshold.
+
+    Sorting the predictions once puts every possible set of positive calls
+    in order, so the counts for all thresholds are cumulative sums instead
+    of one analyze_results() call per cutoff.
+
+    :param y_preds: predictions, shape (N, ).
+    :param truth: 0/1 labels, shape (N, ) or (N, 1); may be scipy.sparse.
+    :return: DataFrame with one row per distinct threshold, from
+        "everything negative" to "everything positive".
+    """
+    if hasattr(truth, 'toarray'):
+        truth = truth.toarray()
+    truth = np.ravel(truth).astype(bool)
+    y_preds = np.ravel(y_preds)
+    N = len(truth)
+    assert y_preds.shape == (N, )
+
+    order = np.argsort(-y_preds, kind='mergesort')
+    preds = y_preds[order]
+    # calling the first k sorted points positive, for each k
+    true_pos = np.concatenate([[0], np.cumsum(truth[order])])
+    false_pos = np.arange(N + 1) - true_pos
+
+    # only keep k where the next prediction differs: ties can't be split.
+    k = np.concatenate([[0], np.flatnonzero(np.diff(preds)) + 1, [N]])
+    # "> threshold" for the first k points only: use the k-th prediction.
+    threshold = np.concatenate([preds, [-np.inf]])[k]
+    true_pos = true_pos[k]
+    false_pos = false_pos[k]
+    positives = truth.sum()
+    false_neg = positives - true_pos
+    true_neg = (N - positives) - false_pos
+
+    called_pos = true_pos + false_pos
+    loss_01 = false_pos + false_neg
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            "threshold": threshold,
+            "true + count": true_pos,
+            "true - count": true_neg,
+            "false + count": false_pos,
+            "false - count": false_neg,
+            "loss_01": loss_01,
+            "loss_01_norm": loss_01/N,
+            "true positive rate": true_pos/positives,
+            "false positive rate": false_pos/(N - positives),
+            # precision is 1 when nothing is called positive.
+            "precision": np.where(called_pos > 0, true_pos/called_pos, 1.),
+            "recall": true_pos/positives})
+
+
+def best_threshold(sweep):
+    """
+    Row of a threshold_sweep() result with the lowest 0/1 loss.
+    """
+    return sweep.loc[sweep["loss_01"].idxmin()]
@@ -1,11 +1,36 @@
 import numpy as np
 import pandas as pd
+import scipy.linalg as linalg
 import scipy.sparse as sp
 import scipy.sparse.linalg as splin
 
 
+def solve_normal_equations(A, B, dense_fraction=0.1):
+    """
+    Solve A W = B for the symmetric positive definite A = lam*I + X^T X
+    without forming A^(-1).
+
+    A mostly filled-in A (e.g. MNIST pixels) gets a dense Cholesky
+    factorization; a sparse one (e.g. bag of words) gets a sparse LU with
+    a symmetric fill-reducing ordering.
+    """
+    if sp.issparse(B):
+        B = B.toarray()
+    if sp.issparse(A) and A.nnz < dense_fraction*A.shape[0]**2:
+        lu = splin.splu(sp.csc_matrix(A), permc_spec='MMD_AT_PLUS_A')
+        return lu.solve(B)
+    if sp.issparse(A):
+        A = A.toarray()
+    return linalg.cho_solve(linalg.cho_factor(A), B)
+
+
 class Ridge:
-    def __init__(self, X, y, lam):
+    def __init__(self, X, y, lam, solver='factorize'):
+        """
+        :param solver: 'factorize' solves the normal equations with a
+            Cholesky/LU factorization; 'inverse' is the original explicit
+            inverse (kept for comparison).
+        """
 
         assert type(X) == sp.csc_matrix or type(X) == sp.csr_matrix
         assert type(lam*1.0) == float
@@ -16,6 +41,8 @@ class Ridge:
         self.y = y
         self.lam = lam
         self.w = None
+        assert solver in ('factorize', 'inverse')
+        self.solver = solver
 
     def solve(self):
 
@@ -23,6 +50,13 @@ class Ridge:
         # find lambda*I_D + X^T*X
         piece_to_invert = sp.identity(d)*self.lam + self.X.T.dot(self.X)
 
+        if self.solver == 'factorize':
+            # (lambda*I_D + X^T*X) w = X^T y.  X^T y is only d x 1.
+            solution = solve_normal_equations(piece_to_invert,
+                                              self.X.T.dot(self.y))
+            self.w = sp.csc_matrix(solution)
+            return
+
         inverted_piece = splin.inv(piece_to_invert)
 
         solution = inverted_piece.dot(self.X.T)
@@ -67,9 +101,67 @@ class RidgeRegularizationPath:
         assert rr.w.shape == (self.train_d, 1) # check before we slice out
         return rr.w.toarray()[:,0], sse_train, sse_val
 
-    def walk_path(self):
+    def eigen_path(self, lams):
+        """
+        Weights, training SSE and validation SSE for every lambda in lams,
+        from one eigendecomposition.
+
+        Decompose the smaller of X^T X (d x d) and X X^T (N x N) once.  With
+        X^T X = V diag(e) V^T and c = V^T X^T y, the ridge solution is
+        w = V diag(1/(e + lambda)) c, so each lambda only rescales c.
+        (Likewise with X X^T = U diag(e) U^T, c = U^T y and w = X^T U
+        diag(1/(e + lambda)) c.)
+        """
+        X = self.train_X
+        y = self.train_y
+        y = np.asarray(y.todense()).ravel() if sp.issparse(y) else np.ravel(y)
+        val_y = self.val_y
+        val_y = np.asarray(val_y.todense()).ravel() if sp.issparse(val_y) \
+            else np.ravel(val_y)
+
+        def dense(m):
+            return m.toarray() if sp.issparse(m) else np.asarray(m)
+
+        results = []
+        if self.train_d <= self.train_N:
+            evals, V = np.linalg.eigh(dense(X.T.dot(X)))
+            evals = np.clip(evals, 0, None)  # round-off can make these < 0
+            c = V.T.dot(np.ravel(dense(X.T.dot(y))))
+            y_squared = y.dot(y)
+            val_XV = dense(self.val_X.dot(V))
+            for lam in lams:
+                coefs = c/(evals + lam)
+                w = V.dot(coefs)
+                # ||y - Xw||^2 = y'y - 2 w'X'y + w'X'Xw
+                sse_train = y_squared - 2*c.dot(coefs) + \
+                    (evals*coefs).dot(coefs)
+                error = val_XV.dot(coefs) - val_y
+                results.append((w, sse_train, error.dot(error)))
+        else:
+            evals, U = np.linalg.eigh(dense(X.dot(X.T)))
+            evals = np.clip(evals, 0, None)
+            c = U.T.dot(y)
+            val_XXU = dense(self.val_X.dot(X.T)).dot(U)
+            for lam in lams:
+                coefs = c/(evals + lam)
+                w = np.ravel(dense(X.T.dot(U.dot(coefs))))
+                # Xw = U diag(e) coefs, so y - Xw = U (lam*coefs)
+                sse_train = ((lam*coefs)**2).sum()
+                error = val_XXU.dot(coefs) - val_y
+                results.append((w, sse_train, error.dot(error)))
+        return results
+
+    def walk_path(self, method='eigen'):
+        """
+        :param method: 'eigen' decomposes X once for the whole path;
+            'refit' solves a new Ridge for every lambda.
+        """
         # protect the first value of lambda.
         lam = self.lam_max/self.frac_decrease
+        lams = [self.lam_max*self.frac_decrease**c
+                for c in range(0, self.steps)]
+        if method == 'eigen':
+            path = self.eigen_path(lams)
 
         # initialize a dataframe to store results in
         results = pd.DataFrame()
@@ -77,7 +169,10 @@ class RidgeRegularizationPath:
             lam = lam*self.frac_decrease
             print("Loop {}: solving weights.  Lambda = {}".format(c+1, lam))
 
-            w, sse_train, sse_val = self.train_with_lam(lam)
+            if method == 'eigen':
+                w, sse_train, sse_val = path[c]
+            else:
+                w, sse_train, sse_val = self.train_with_lam(lam)
 
             one_val = pd.DataFrame({"lam":[lam],
                                     "weights":[w],
@@ -0,0 +1,200 @@
+"""
+Time SparseLasso and RegularizationPath against sklearn on synthetic data,
+so we can see regressions in our solver and where it loses to sklearn.
+
+Example:
+    python benchmark_lasso.py
+writes lasso_benchmark.csv and lasso_benchmark.json.
+"""
+import itertools
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn import linear_model
+
+from lasso import SparseLasso, RegularizationPath, generate_sparse_random_data
+
+
+def measure(fun):
+    """
+    Call fun() and return (result, wall time in seconds, peak MB allocated
+    while it ran).  Peak memory comes from tracemalloc, so it only counts
+    allocations that go through Python's allocator (numpy arrays do).
+    """
+    tracemalloc.start()
+    start = time.time()
+    result = fun()
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak/2.**20
+
+
+def lasso_objective(X, y, lam, w, w0):
+    error = X.dot(w) + w0 - y
+    return error.dot(error) + lam*np.absolute(w).sum()
+
+
+def lambda_max(X, y):
+    """
+    Smallest lambda for which all of the weights are zero.
+    """
+    return np.absolute(2*X.T.dot(y - y.mean())).max()
+
+
+def benchmark_sparse_lasso(X, y, lam, delta, solver):
+    def fit():
+        sl = SparseLasso(X, y, lam, w=np.zeros(X.shape[1]), delta=delta,
+                         solver=solver)
+        sl.run()
+        return sl
+    sl, seconds, peak_MB = measure(fit)
+    return {"method": "SparseLasso ({})".format(solver),
+            "seconds": seconds, "peak MB": peak_MB,
+            "sweeps": len(sl.sweep_times),
+            "objective": lasso_objective(X, y, lam, sl.w, sl.w0)}
+
+
+def benchmark_sklearn_lasso(X, y, lam):
+    def fit():
+        clf = linear_model.Lasso(alpha=lam/(2.*X.shape[0]))
+        clf.fit(X, y)
+        return clf
+    clf, seconds, peak_MB = measure(fit)
+    return {"method": "sklearn Lasso",
+            "seconds": seconds, "peak MB": peak_MB,
+            "sweeps": clf.n_iter_,
+            "objective": lasso_objective(X, y, lam, clf.coef_,
+                                         clf.intercept_)}
+
+
+def path_lambdas(lam_max, frac_decrease, steps):
+    return lam_max*frac_decrease**np.arange(steps)
+
+
+def benchmark_path(X, y, lam_max, frac_decrease, steps, delta, solver):
+    """
+    Walk the lambda grid with RegularizationPath.  The objective is for the
+    last (smallest) lambda.
+    """
+    lams = path_lambdas(lam_max, frac_decrease, steps)
+
+    def our_path():
+        reg_path = RegularizationPath(X, y, lam_max=lam_max,
+                                      frac_decrease=frac_decrease,
+                                      steps=steps, delta=delta,
+                                      solver=solver)
+        reg_path.walk_path()
+        return reg_path.results_df
+    results_df, seconds, peak_MB = measure(our_path)
+    last = results_df.tail(1).reset_index()
+    return {"method": "RegularizationPath ({})".format(solver),
+            "seconds": seconds, "peak MB": peak_MB,
+            "objective": lasso_objective(X, y, lams[-1],
+                                         last['weights'][0],
+                                         last['w0'][0])}
+
+
+def benchmark_sklearn_paths(X, y, lam_max, frac_decrease, steps):
+    """
+    Walk the same lambda grid with sklearn's Lasso (warm-started) and with
+    sklearn's lasso_path.  Only depends on the problem, so run it once per
+    problem, not once per solver of ours.
+
+    lasso_path has no intercept, so it gets a centered y; its time is
+    reported but not its objective.
+    """
+    lams = path_lambdas(lam_max, frac_decrease, steps)
+    alphas = lams/(2.*X.shape[0])
+    rows = []
+
+    def sklearn_path():
+        clf = linear_model.Lasso(alpha=alphas[0], warm_start=True)
+        for alpha in alphas:
+            clf.alpha = alpha
+            clf.fit(X, y)
+        return clf
+    clf, seconds, peak_MB = measure(sklearn_path)
+    rows.append({"method": "sklearn Lasso path (warm start)",
+                 "seconds": seconds, "peak MB": peak_MB,
+                 "objective": lasso_objective(X, y, lams[-1], clf.coef_,
+                                              clf.intercept_)})
+
+    y_centered = y - y.mean()
+    _, seconds, peak_MB = measure(
+        lambda: linear_model.lasso_path(X, y_centered, alphas=alphas))
+    rows.append({"method": "sklearn lasso_path (no intercept)",
+                 "seconds": seconds, "peak MB": peak_MB,
+                 "objective": np.nan})
+    return rows
+
+
+def json_records(results):
+    """
+    The rows of results as dicts, with NaN (not valid JSON) as None.
+    """
+    return [{k: None if isinstance(v, float) and np.isnan(v) else v
+             for k, v in row.items()}
+            for row in results.to_dict(orient='records')]
+
+
+def run_benchmarks(sizes=((1000, 5000), (10000, 2000)),
+                   densities=(0.01, ), lam_fracs=(0.5, 0.1),
+                   solvers=('csc', 'covariance'),
+                   path_steps=10, path_frac_decrease=0.7,
+                   delta=1e-3, k=10, sigma=1., seed=0,
+                   filename='lasso_benchmark'):
+    """
+    Sweep N, d, density and lambda (as a fraction of lambda_max).  One row
+    per (problem, method); 'objective gap' is our objective minus
+    sklearn's for the same problem.  Results are written to
+    filename.csv and filename.json.
+    """
+    rows = []
+    for (N, d), density in itertools.product(sizes, densities):
+        print("N = {}, d = {}, density = {}".format(N, d, density))
+        X, y, _ = generate_sparse_random_data(N, d, sigma=sigma, k=k,
+                                              density=density, seed=seed)
+        lam_max = lambda_max(X, y)
+        problem = {"N": N, "d": d, "density": density, "nnz": X.nnz}
+
+        for lam_frac in lam_fracs:
+            lam = lam_max*lam_frac
+            sklearn_row = benchmark_sklearn_lasso(X, y, lam)
+            fits = [benchmark_sparse_lasso(X, y, lam, delta, solver)
+                    for solver in solvers]
+            for row in fits + [sklearn_row]:
+                row.update(problem)
+                row.update({"lambda/lambda_max": lam_frac,
+                            "objective gap":
+                                row["objective"] - sklearn_row["objective"]})
+                rows.append(row)
+
+        sklearn_rows = benchmark_sklearn_paths(X, y, lam_max,
+                                               path_frac_decrease, path_steps)
+        path_rows = [benchmark_path(X, y, lam_max, path_frac_decrease,
+                                    path_steps, delta, solver)
+                     for solver in solvers]
+        for row in path_rows + sklearn_rows:
+            # objective at the smallest lambda, relative to sklearn's path.
+            row["objective gap"] = \
+                row["objective"] - sklearn_rows[0]["objective"]
+            row.update(problem)
+            row.update({"lambda/lambda_max":
+                            path_frac_decrease**(path_steps - 1),
+                        "path steps": path_steps})
+            rows.append(row)
+
+    results = pd.DataFrame(rows)
+    results.to_csv(filename + '.csv', index=False)
+    with open(filename + '.json', 'w') as f:
+        json.dump(json_records(results), f, indent=2, default=float,
+                  allow_nan=False)
+    return results
+
+
+if __name__ == '__main__':
+    print(run_benchmarks())
@@ -2,13 +2,16 @@ import numpy as np
 import scipy.sparse as sp
 # analyze my solution by comparing objective functions
 from sklearn import linear_model
+import multiprocessing as mp
 import sys
+import time
 import pandas as pd
 
 
 class SparseLasso:
     def __init__(self, X, y, lam, w=None, w0=0, delta=0.01,
-                 verbose = False, max_iter = 100000):
+                 verbose = False, max_iter = 100000, solver='naive',
+                 objective_check_freq=1, dtype=np.float64):
         """
 
         :param X:
@@ -19,17 +22,26 @@ class SparseLasso:
         :param delta:
         :param verbose:
         :param max_iter:
+        :param solver: 'naive' slices X column by column (original version),
+            'csc' reads the CSC indptr/indices/data arrays directly,
+            'covariance' works from X^T X columns (good when N >> d), and
+            'auto' picks 'covariance' when N >> d, else 'csc'.
+        :param objective_check_freq: check that the objective didn't go up
+            every this many sweeps (and at convergence).
+        :param dtype: storage type for X, y, the residual and w.  np.float32
+            halves the memory of a big problem.
         """
 
-        self.X = sp.csc_matrix(X)
+        self.dtype = dtype
+        self.X = sp.csc_matrix(X, dtype=dtype)
         self.N, self.d = self.X.shape
-        self.y = y
+        self.y = np.asarray(y, dtype=dtype)
         assert self.y.shape == (self.N, )
 
         if w is None:
-            self.w = np.ones(self.d)
+            self.w = np.ones(self.d, dtype=dtype)
         elif type(w) == np.ndarray:
-            self.w = w
+            self.w = w.astype(dtype, copy=False)
         else:
             assert False, "w is not None or a numpy array."
         assert self.w.shape == (self.d ,), \
@@ -39,16 +51,64 @@ class SparseLasso:
         self.delta = delta
         self.verbose = verbose
         self.max_iter = max_iter
-        # a is twice the column-wise dot of X with itself
-        self.a = np.zeros(self.d)
-        for k in range(0, self.d):
-            self.a[k] = 2 * (self.X[:, k].T.dot(self.X[:, k]))[0,0]
-        self.XT = sp.csr_matrix(X.T)
+        # a is twice the column-wise dot of X with itself.
+        # Label every stored value with its column and sum the squares.
+        columns = np.repeat(np.arange(self.d), np.diff(self.X.indptr))
+        self.a = 2 * np.bincount(columns, weights=self.X.data**2,
+                                 minlength=self.d).astype(dtype)
+
+        if solver == 'auto':
+            solver = 'covariance' if self.N > 5*self.d else 'csc'
+        assert solver in ('naive', 'csc', 'covariance'), \
+            "unknown solver: {}".format(solver)
+        self.solver = solver
+        # columns of X^T X, only computed for features that become nonzero.
+        self.gram_columns = {}
+        # wall time of each pass over the d coordinates
+        self.sweep_times = []
+        self.objective_check_freq = objective_check_freq
+
+        # residual y - Xw - w0 and |w|_1, kept up to date by the sweeps.
+        self.r = None
+        self.l1 = None
+        self.residual_for = (None, None)  # (w, w0) that self.r belongs to
+
+    def refresh_residual(self):
+        """
+        Recompute the cached residual and L1 norm from scratch.
+        """
+        self.r = self.y - self.X.dot(self.w) - self.w0
+        self.l1 = np.absolute(self.w).sum()
+        self.residual_for = (self.w, self.w0)
+
+    def residual(self):
+        """
+        Cached y - Xw - w0.  Only recomputed if w or w0 were replaced from
+        outside the solver (e.g. by sklearn_comparison).
+        """
+        w, w0 = self.residual_for
+        if self.r is None or w is not self.w or w0 != self.w0:
+            self.refresh_residual()
+        return self.r
+
+    def shift_intercept(self, change):
+        self.w0 += change
+        self.r -= change
+        self.residual_for = (self.w, self.w0)
+
+    def update_weight(self, k, new_wk):
+        """
+        Set w_k and keep the L1 norm in sync.  Returns the change in w_k.
+        """
+        old_wk = self.w[k]
+        self.w[k] = new_wk
+        self.l1 += abs(new_wk) - abs(old_wk)
+        return new_wk - old_wk
 
     def sse(self):
         # SSE is sum of residuals squared
-        error_v = self.X.dot(self.w) + self.w0 - self.y
-        return error_v.T.dot(error_v)
+        r = self.residual()
+        return r.dot(r)
 
     def rmse(self):
         # RMSE = root mean square error
@@ -57,43 +117,187 @@ class SparseLasso:
         return mse**0.5 # **0.5 for the R in the RMSE
 
     def objective(self):
-        return  self.sse() + self.lam*np.linalg.norm(self.w,1)
+        sse = self.sse()  # also brings self.l1 up to date
+        return sse + self.lam*self.l1
 
-    def step(self):
-        yhat = self.X.dot(self.w) + self.w0
-        old_w0 = self.w0
-        self.w0 += (self.y - yhat).sum()/self.N
-        yhat += self.w0 - old_w0
+    def step(self, coords=None):
+        """
+        One pass of coordinate descent over `coords` (default: all d).
+        """
+        if coords is None:
+            coords = range(0, self.d)
+        r = self.residual()
+        self.shift_intercept(r.sum()/self.N)
 
-        for k in range(0, self.d):
+        for k in coords:
             # Un-clever version:
             # ck = 2 * self.extract_scalar(Xk.T.dot(self.y - yhat + Xk*self.w[k, 0]))
-            ck = 2 * self.X[:, k].T.dot(self.y - yhat)[0] + self.a[k]*self.w[k]
-            old_wk = self.w[k]
-            if ck < - self.lam:
-                self.w[k] = (ck + self.lam)/self.a[k]
-            elif ck > self.lam:
-                self.w[k] = (ck - self.lam)/self.a[k]
-            else:
-                self.w[k] = 0.
-            yhat += (self.XT[k,:]*(self.w[k] - old_wk)).toarray()[0]
-
-
-    def run(self):
+            Xk = self.X[:, k]
+            ck = 2 * Xk.T.dot(r)[0] + self.a[k]*self.w[k]
+            change = self.update_weight(k, self.soft_threshold(k, ck))
+            r -= Xk.toarray()[:, 0]*change
+
+    def soft_threshold(self, k, ck):
+        if ck < - self.lam:
+            return (ck + self.lam)/self.a[k]
+        elif ck > self.lam:
+            return (ck - self.lam)/self.a[k]
+        else:
+            return 0.
+
+    def step_csc(self, coords=None):
+        """
+        Same update as step(), but reads column k straight out of the CSC
+        arrays instead of building a sparse slice for every coordinate.
+        """
+        if coords is None:
+            coords = range(0, self.d)
+        indptr, indices, data = self.X.indptr, self.X.indices, self.X.data
+        r = self.residual()
+        # the intercept update shifts every residual by the same amount.
+        self.shift_intercept(r.sum()/self.N)
+
+        for k in coords:
+            start, end = indptr[k], indptr[k+1]
+            rows = indices[start:end]
+            vals = data[start:end]
+            ck = 2 * vals.dot(r[rows]) + self.a[k]*self.w[k]
+            change = self.update_weight(k, self.soft_threshold(k, ck))
+            if change != 0:
+                r[rows] -= vals*change
+
+    def gram_column(self, k):
+        """
+        Column k of X^T X, computed the first time feature k is nonzero.
+        """
+        if k not in self.gram_columns:
+            start, end = self.X.indptr[k], self.X.indptr[k+1]
+            xk = np.zeros(self.N, dtype=self.dtype)
+            xk[self.X.indices[start:end]] = self.X.data[start:end]
+            self.gram_columns[k] = self.X.T.dot(xk)
+        return self.gram_columns[k]
+
+    def step_covariance(self, coords=None):
+        """
+        Covariance-update version of step() for N >> d.
+
+        X_k^T r = X_k^T y - w0*sum(X_k) - (X^T X w)_k, so we keep the vector
+        X^T r up to date instead of the N-long residual.  A coordinate that
+        stays at zero costs O(1); a coordinate that changes costs one
+        d-long axpy with its (cached) Gram column, so a sweep scales with
+        the active set rather than with nnz(X).
+
+        The N-long residual is not maintained here; it is recomputed the
+        next time sse() or objective() asks for it.
+        """
+        if coords is None:
+            coords = range(0, self.d)
+        if not hasattr(self, 'Xty'):
+            self.Xty = self.X.T.dot(self.y)
+            self.col_sums = np.asarray(self.X.sum(axis=0)).ravel()
+            self.y_sum = self.y.sum()
+
+        self.w0 = (self.y_sum - self.col_sums.dot(self.w))/self.N
+        Xtr = self.Xty - self.w0*self.col_sums
+        for j in np.flatnonzero(self.w):
+            Xtr -= self.gram_column(j)*self.w[j]
+
+        for k in coords:
+            ck = 2 * Xtr[k] + self.a[k]*self.w[k]
+            new_wk = self.soft_threshold(k, ck)
+            if new_wk != self.w[k]:
+                Xtr -= self.gram_column(k)*(new_wk - self.w[k])
+                self.w[k] = new_wk
+        self.r = None
+
+    def sweep(self, coords=None):
+        sweep_start = time.time()
+        if self.solver == 'csc':
+            self.step_csc(coords)
+        elif self.solver == 'covariance':
+            self.step_covariance(coords)
+        else:
+            self.step(coords)
+        self.sweep_times.append(time.time() - sweep_start)
+
+    def run(self, coords=None):
+        # start from a fresh residual so rounding errors don't pile up
+        # across runs.
+        self.refresh_residual()
+        old_objective = self.objective()
         for s in range(0, self.max_iter):
-            old_objective = self.objective()
             old_w = self.w.copy()
             sys.stdout.write(".")
-            self.step()
-            assert not self.has_increased_significantly(
-                    old_objective, self.objective()), \
-                "objective: {} --> {}".format(old_objective, self.objective())
-            if abs(old_w - self.w).max() < self.delta:
+            self.sweep(coords)
+            converged = abs(old_w - self.w).max() < self.delta
+            if converged or (s + 1) % self.objective_check_freq == 0:
+                new_objective = self.objective()
+                assert not self.has_increased_significantly(
+                        old_objective, new_objective), \
+                    "objective: {} --> {}".format(old_objective, new_objective)
+                old_objective = new_objective
+            if converged:
                 break
 
         if self.verbose:
             print(self.objective())
             print(self.w)
+            print("{} sweeps; seconds per sweep: {}".format(
+                len(self.sweep_times), self.sweep_times))
+
+    def correlations(self):
+        """
+        2 X^T r, with r the residual for the current w and the intercept
+        that is optimal for it.  At a solution, |2 X_k^T r| <= lam for every
+        k with w_k = 0 (the KKT conditions).
+        """
+        r = self.residual()
+        return 2 * self.X.T.dot(r - r.mean())
+
+    def run_active_set(self, candidates=None):
+        """
+        Fit only the features in `candidates`; the rest are held at zero.
+
+        Coordinate descent runs over the nonzero weights until they
+        converge, then one pass over all candidates checks whether the
+        active set changed.  Once it is stable, the KKT conditions are
+        checked for the features that were left out and any violators are
+        added back in.
+
+        :return: number of left-out features that violated the KKT
+            conditions and had to be added back.
+        """
+        if candidates is None:
+            candidates = np.arange(self.d)
+        candidates = np.asarray(candidates)
+        left_out = np.ones(self.d, dtype=bool)
+        left_out[candidates] = False
+        self.w[left_out] = 0.
+        self.refresh_residual()
+        num_violations = 0
+
+        while True:
+            while True:
+                active = candidates[self.w[candidates] != 0]
+                self.run(coords=active)
+                old_w = self.w.copy()
+                self.sweep(candidates)
+                new_active = candidates[self.w[candidates] != 0]
+                if np.array_equal(active, new_active) and \
+                        abs(old_w - self.w).max() < self.delta:
+                    break
+
+            if not left_out.any():
+                break
+            violators = np.flatnonzero(
+                left_out & (np.absolute(self.correlations()) > self.lam))
+            if len(violators) == 0:
+                break
+            num_violations += len(violators)
+            left_out[violators] = False
+            candidates = np.flatnonzero(~left_out)
+
+        return num_violations
 
 
     @staticmethod
@@ -120,28 +324,34 @@ def sklearn_comparison(X, y, lam, sparse = False):
             "intercept": clf.intercept_})
 
 
-def generate_random_data(N, d, sigma, k=5):
+def true_weights(d, k=5, signal=10.):
+    """
+    w* with the first k elements nonzero, alternating +signal, -signal.
+    """
+    assert k <= d
+    w = np.zeros(d, dtype=float)
+    w[0:k] = signal
+    w[1:k:2] = -signal
+    return w
+
+
+def generate_random_data(N, d, sigma, k=5, signal=10., seed=None):
     assert(d > N)
+    rng = np.random.RandomState(seed)
 
     # generate w0
     w0 = 0
     # generate X
-    X = np.reshape(np.random.normal(0, 1, N*d),
+    X = np.reshape(rng.normal(0, 1, N*d),
                    newshape = (N, d), order='C')
     assert X.shape == (N, d)
 
     # generate w* with the first k elements being nonzero.
-    # todo: k is hard coded for now.
-    w = np.zeros(d, dtype=float)
-    w[0] = 10.
-    w[1] = -10
-    w[2] = 10
-    w[3] = -10
-    w[4] = 10
+    w = true_weights(d, k=k, signal=signal)
     assert w.shape == (d, )
 
     # generate error
-    e = np.random.normal(0, sigma, N)
+    e = rng.normal(0, sigma, N)
     assert e.shape == (N, )
 
     # generate noisy Y
@@ -154,24 +364,110 @@ def generate_random_data(N, d, sigma, k=5):
     return X, Y, w
 
 
+def generate_random_data_chunks(N, d, sigma, k=5, signal=10., density=None,
+                                chunk_size=None, seed=None):
+    """
+    Yield (X_chunk, y_chunk) blocks of rows, so data sets that don't fit in
+    memory as a dense N x d array can be streamed.
+
+    :param density: None for dense Gaussian chunks; otherwise each chunk
+        is a CSR matrix with about this fraction of entries nonzero (and
+        Gaussian values).
+    :param chunk_size: rows per chunk.  Defaults to about 10^7 stored
+        values per chunk.
+    :param seed: seed for the whole stream, so it can be regenerated.
+    """
+    rng = np.random.RandomState(seed)
+    w = true_weights(d, k=k, signal=signal)
+    if chunk_size is None:
+        values_per_row = d if density is None else max(d*density, 1.)
+        chunk_size = max(1, int(10**7/values_per_row))
+
+    for start in range(0, N, chunk_size):
+        n = min(chunk_size, N - start)
+        if density is None:
+            X_chunk = rng.normal(0, 1, size=(n, d))
+        else:
+            nnz = rng.binomial(n*d, density)
+            X_chunk = sp.csr_matrix(
+                (rng.normal(0, 1, nnz),
+                 (rng.randint(0, n, nnz), rng.randint(0, d, nnz))),
+                shape=(n, d))
+        y_chunk = X_chunk.dot(w) + rng.normal(0, sigma, n)
+        yield X_chunk, y_chunk
+
+
+def generate_sparse_random_data(N, d, sigma, k=5, signal=10., density=0.01,
+                                chunk_size=None, seed=None):
+    """
+    Like generate_random_data, but X is built chunk by chunk as a CSC
+    matrix with the given density, so (N=1e6, d=1e5) fits in memory.
+    """
+    X_chunks, y_chunks = [], []
+    for X_chunk, y_chunk in generate_random_data_chunks(
+            N, d, sigma, k=k, signal=signal, density=density,
+            chunk_size=chunk_size, seed=seed):
+        X_chunks.append(X_chunk)
+        y_chunks.append(y_chunk)
+    X = sp.vstack(X_chunks, format='csr').tocsc()
+    y = np.concatenate(y_chunks)
+    w = true_weights(d, k=k, signal=signal)
+
+    assert X.shape == (N, d)
+    assert y.shape == (N, )
+    return X, y, w
+
+
 class RegularizationPath:
     def __init__(self, X, y, lam_max, frac_decrease, steps, delta,
-                 initial_w=None):
-        self.X = X
-        self.y = y
+                 initial_w=None, screening=True, solver='naive',
+                 dtype=np.float64):
+        """
+        :param screening: use sequential strong rules to drop features
+            before fitting each lambda, and only sweep the active set.
+            Dropped features are re-checked against the KKT conditions, so
+            the weights are the same as without screening.
+        :param solver: passed to SparseLasso.
+        :param dtype: passed to SparseLasso.  X and y are converted once
+            here rather than once per lambda.
+        """
+        self.X = sp.csc_matrix(X, dtype=dtype)
+        self.y = np.asarray(y, dtype=dtype)
         self.N, self.d = self.X.shape
         self.lam_max = lam_max
         self.frac_decrease = frac_decrease
         self.steps = steps
         self.delta = delta
         self.initial_w = initial_w
-
-    def analyze_lam(self, lam, w):
-        sl = SparseLasso(self.X, self.y, lam, w=w, delta=self.delta)
-        sl.run()
+        self.screening = screening
+        self.solver = solver
+        self.dtype = dtype
+
+    def analyze_lam(self, lam, w, lam_prev=None):
+        if self.screening and w is None:
+            w = np.zeros(self.d, dtype=self.dtype)
+        sl = SparseLasso(self.X, self.y, lam, w=w, delta=self.delta,
+                         solver=self.solver, dtype=self.dtype)
+        screened = {"# features screened out": 0, "# KKT violations": 0}
+        if self.screening:
+            candidates = self.strong_rule_candidates(sl, lam, lam_prev)
+            screened["# features screened out"] = self.d - len(candidates)
+            screened["# KKT violations"] = sl.run_active_set(candidates)
+        else:
+            sl.run()
         print("")
         assert sl.w.shape == (self.d, )
-        return sl.w.copy(), sl.w0
+        return sl.w.copy(), sl.w0, screened
+
+    @staticmethod
+    def strong_rule_candidates(sl, lam, lam_prev):
+        """
+        Sequential strong rule: keep feature k for lam if it is already
+        nonzero or |2 X_k^T r(lam_prev)| >= 2*lam - lam_prev.
+        """
+        keep = np.absolute(sl.correlations()) >= 2*lam - lam_prev
+        keep |= sl.w != 0
+        return np.flatnonzero(keep)
 
     def walk_path(self):
         # protect the first value of lambda.
@@ -188,11 +484,16 @@ class RegularizationPath:
             print("Loop {}: solving weights for lambda = {}.".format(c+1, lam))
 
 
-            w, w0 = self.analyze_lam(lam, w=w_prev)
+            w, w0, screened = self.analyze_lam(
+                lam, w=w_prev, lam_prev=lam/self.frac_decrease)
 
             one_val = pd.DataFrame({"lam":[lam],
                                     "weights":[w],
-                                    "w0": [w0]})
+                                    "w0": [w0],
+                                    "# features screened out":
+                                        [screened["# features screened out"]],
+                                    "# KKT violations":
+                                        [screened["# KKT violations"]]})
             results = pd.concat([results, one_val])
             w_prev = w.copy()
 
@@ -201,23 +502,35 @@ class RegularizationPath:
 
 class SyntheticDataRegPath():
     def __init__(self, N, d, sigma, lam_max, frac_decrease, delta,
-                 k=5, steps=10):
+                 k=5, steps=10, signal=10., density=None, seed=None,
+                 solver='naive', dtype=np.float64):
+        """
+        :param density: if given, X is a sparse CSC matrix with this
+            fraction of nonzero entries, built in chunks.  Otherwise X is
+            a dense Gaussian matrix.
+        """
         self.N = N
         self.d = d
         self.sigma = sigma
         self.k = k
         self.init_lam = lam_max
         self.frac_decrease = frac_decrease
-        X, y, true_weights = generate_random_data(N=N, d=d,
-                                                  sigma=sigma, k=k)
+        if density is None:
+            X, y, w = generate_random_data(N=N, d=d, sigma=sigma, k=k,
+                                           signal=signal, seed=seed)
+        else:
+            X, y, w = generate_sparse_random_data(N=N, d=d, sigma=sigma, k=k,
+                                                  signal=signal,
+                                                  density=density, seed=seed)
         self.X = X
         self.y = y
-        self.true_weights = true_weights
+        self.true_weights = w
         self.lam_max = lam_max
         reg_path = RegularizationPath(X=self.X, y=self.y,
                                       lam_max=self.lam_max,
                                       frac_decrease=self.frac_decrease,
-                                      steps=steps, delta=delta)
+                                      steps=steps, delta=delta,
+                                      solver=solver, dtype=dtype)
         reg_path.walk_path()
         self.results_df = reg_path.results_df
 
@@ -276,28 +589,52 @@ class RegularizationPathTrainTest:
         self.results_df = reg_path.results_df
         self.feature_names = feature_names
 
-    def analyze_path(self):
+    def analyze_path(self, z=0.001, n_features=10):
+        # Stack the path into one (d x steps) matrix so every lambda is
+        # evaluated with a single matrix product per data set.
+        W = self.path_weights()
+        w0 = self.results_df['w0'].values.astype(float)
+
         self.results_df['RMSE (training)'] = \
-            self.results_df.apply(
-                lambda x: self.rmse_train(x['weights'], x['w0']), axis=1)
+            self.path_rmse(self.X_train, self.y_train, W, w0)
         self.results_df['RMSE (validation)'] = \
-            self.results_df.apply(
-                lambda x: self.rmse_val(x['weights'], x['w0']), axis=1)
+            self.path_rmse(self.X_val, self.y_val, W, w0)
 
         self.results_df['# nonzero coefficients'] = \
-            self.results_df['weights'].apply(self.num_nonzero_coefs)
+            (np.absolute(W) > z).sum(axis=0)
 
         self.results_df['top_features'] = \
-            self.results_df['weights'].apply(self.top_features)
+            self.path_top_features(W, n_features=n_features)
+
+    def path_weights(self):
+        return np.column_stack(self.results_df['weights'].tolist())
+
+    @staticmethod
+    def path_rmse(X, y, W, w0):
+        """
+        RMSE of every column of W (with intercepts w0) on (X, y).
+        """
+        errors = X.dot(W) + w0 - np.reshape(y, (X.shape[0], 1))
+        return (np.multiply(errors, errors).sum(axis=0)/X.shape[0])**0.5
+
+    def path_top_features(self, W, n_features=10):
+        """
+        Names and weights of the n_features largest |weights| for every
+        column of W, biggest first.
+        """
+        abs_W = np.absolute(W)
+        n_features = min(n_features, W.shape[0])
+        columns = np.arange(W.shape[1])
+        # unordered top n_features per column, then sort just those.
+        top = np.argpartition(-abs_W, n_features - 1,
+                              axis=0)[:n_features, :]
+        order = np.argsort(-abs_W[top, columns], axis=0)
+        top = top[order, columns]
+        return [(self.feature_names[top[:, c]].tolist(), W[top[:, c], c])
+                for c in columns]
 
     def calc_rmse(self, X, w, w0, y):
-        # re-use the formula implemented in SparseLasso.
-        # put in a random lam b/c it isn't used.
-        sl = SparseLasso(X, y, lam=0, verbose=False)
-        # store solutions in my Lasso class so I can look @ obj fun
-        sl.w = w.copy()
-        sl.w0 = w0
-        return sl.rmse()
+        return self.path_rmse(X, y, np.reshape(w, (-1, 1)), w0)[0]
 
     def rmse_train(self, w, w0):
         return self.calc_rmse(X=self.X_train, w=w, w0=w0, y=self.y_train)
@@ -310,11 +647,152 @@ class RegularizationPathTrainTest:
         return nonzero_weights.sum()
 
     def top_features(self, w, n_features=10):
-        w = w.copy()
-        abs_w = np.absolute(w.copy())
-        feature_names = self.feature_names
-        best_indices = abs_w.argsort()[-n_features:][::-1]   # get the top n_f features.  (They are at the back of the list.)
-        print(np.argsort(best_indices))
-        print(np.argsort(w[best_indices]))
-        return feature_names[best_indices].tolist(), w[best_indices]
+        return self.path_top_features(np.reshape(w, (-1, 1)),
+                                      n_features=n_features)[0]
+
+
+# CSC arrays of the design matrix, shared with the worker processes of
+# RegularizationPathCrossValidation.  Filled in by attach_shared_data.
+shared_data = {}
+
+
+def to_shared_array(a):
+    """
+    Copy a numpy array into shared memory that child processes can read.
+    """
+    a = np.ascontiguousarray(a)
+    buffer = mp.RawArray('b', max(a.nbytes, 1))
+    np.frombuffer(buffer, dtype=a.dtype, count=a.size)[:] = a.ravel()
+    return buffer, a.dtype.str, a.shape
+
+
+def attach_shared_data(shared):
+    """
+    Pool initializer: wrap the shared buffers as numpy arrays (no copy).
+    """
+    for name, (buffer, dtype, shape) in shared.items():
+        size = int(np.prod(shape))
+        shared_data[name] = \
+            np.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
+
+def fit_path_segment(task):
+    """
+    Walk one segment of the lambda grid for one fold, warm-starting within
+    the segment.  Runs in a worker process.
+    """
+    X = sp.csc_matrix((shared_data['data'], shared_data['indices'],
+                       shared_data['indptr']), shape=task['shape'])
+    y = shared_data['y']
+    X_train, y_train = X[task['train_rows']], y[task['train_rows']]
+    X_val, y_val = X[task['val_rows']], y[task['val_rows']]
+
+    reg_path = RegularizationPath(X=X_train, y=y_train,
+                                  lam_max=task['lams'][0],
+                                  frac_decrease=task['frac_decrease'],
+                                  steps=len(task['lams']),
+                                  delta=task['delta'],
+                                  screening=task['screening'],
+                                  solver=task['solver'],
+                                  dtype=task['dtype'])
+    reg_path.walk_path()
+    results = reg_path.results_df
+
+    def rmse(X, y, w, w0):
+        error = X.dot(w) + w0 - y
+        return (error.dot(error)/X.shape[0])**0.5
+
+    results['fold'] = task['fold']
+    results['RMSE (training)'] = [rmse(X_train, y_train, w, w0) for w, w0
+                                  in zip(results['weights'], results['w0'])]
+    results['RMSE (validation)'] = [rmse(X_val, y_val, w, w0) for w, w0
+                                    in zip(results['weights'], results['w0'])]
+    return results
+
+
+class RegularizationPathCrossValidation:
+    """
+    K-fold cross-validation of the Lasso regularization path, with the
+    folds (and optionally independent segments of the lambda grid) fit in
+    a process pool.
+
+    The CSC arrays of X are copied into shared memory once; workers wrap
+    them without pickling X for every task.  Within a segment, each lambda
+    is warm-started from the previous one.
+    """
+    def __init__(self, X, y, lam_max, frac_decrease=0.1, steps=10,
+                 delta=0.01, n_folds=5, segments=1, processes=None,
+                 screening=True, solver='naive', dtype=np.float64,
+                 seed=None):
+        """
+        :param n_folds: number of cross-validation folds (at least 2).
+        :param segments: split the lambda grid into this many pieces that
+            are fit independently.  More segments means more parallelism
+            but fewer warm starts.
+        :param processes: size of the process pool.  Defaults to the
+            number of CPUs; 1 fits everything in this process.
+        :param seed: seeds the assignment of points to folds.
+        """
+        assert n_folds >= 2, "need at least 2 folds to cross-validate."
+        self.X = sp.csc_matrix(X, dtype=dtype)
+        self.y = np.asarray(y, dtype=dtype)
+        self.N, self.d = self.X.shape
+        assert self.y.shape == (self.N, )
+        self.lam_max = lam_max
+        self.frac_decrease = frac_decrease
+        self.steps = steps
+        self.delta = delta
+        self.n_folds = n_folds
+        self.segments = min(segments, steps)
+        self.processes = processes
+        self.screening = screening
+        self.solver = solver
+        self.dtype = dtype
+        self.fold_ids = np.random.RandomState(seed).permutation(
+            np.arange(self.N) % n_folds)
+
+    def tasks(self):
+        lams = self.lam_max*self.frac_decrease**np.arange(self.steps)
+        tasks = []
+        for fold in range(self.n_folds):
+            for segment in np.array_split(lams, self.segments):
+                tasks.append({"fold": fold,
+                              "lams": segment,
+                              "train_rows": np.flatnonzero(
+                                  self.fold_ids != fold),
+                              "val_rows": np.flatnonzero(
+                                  self.fold_ids == fold),
+                              "shape": self.X.shape,
+                              "frac_decrease": self.frac_decrease,
+                              "delta": self.delta,
+                              "screening": self.screening,
+                              "solver": self.solver,
+                              "dtype": self.dtype})
+        return tasks
+
+    def walk_path(self):
+        shared = {"data": to_shared_array(self.X.data),
+                  "indices": to_shared_array(self.X.indices),
+                  "indptr": to_shared_array(self.X.indptr),
+                  "y": to_shared_array(self.y)}
+        if self.processes == 1:
+            attach_shared_data(shared)
+            results = [fit_path_segment(t) for t in self.tasks()]
+        else:
+            pool = mp.Pool(processes=self.processes,
+                           initializer=attach_shared_data,
+                           initargs=(shared,))
+            try:
+                results = pool.map(fit_path_segment, self.tasks())
+            finally:
+                pool.close()
+                pool.join()
+
+        results = pd.concat(results)
+        results = results.sort_values(by=['fold', 'lam'],
+                                      ascending=[True, False])
+        self.results_df = results.reset_index(drop=True)
 
+        # average over folds for each lambda.
+        self.summary_df = self.results_df.groupby('lam', sort=False)[
+            ['RMSE (training)', 'RMSE (validation)']].mean().reset_index()
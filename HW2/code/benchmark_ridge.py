@@ -0,0 +1,88 @@
+"""
+Compare the time and memory of RidgeMulti's factorization-based solve with
+the original explicit-inverse solve.
+
+Example:
+    python benchmark_ridge.py
+writes ridge_benchmark.csv.
+"""
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from ridge_regression import RidgeMulti
+
+
+def measure(fun):
+    """
+    Call fun() and return (result, wall time in seconds, peak MB allocated
+    while it ran, as seen by tracemalloc).
+    """
+    tracemalloc.start()
+    start = time.time()
+    result = fun()
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak/2.**20
+
+
+def mnist_sized_data(N=60000, d=784, C=10, seed=0):
+    """
+    Dense pixel-like data: integers 0-255, mostly zeros.
+    """
+    rng = np.random.RandomState(seed)
+    X = rng.randint(0, 256, size=(N, d)) * (rng.rand(N, d) < 0.2)
+    y = rng.randint(0, C, size=N)
+    return X.astype(float), y
+
+
+def wide_sparse_data(N=2000, d=5000, C=10, density=0.001, seed=0):
+    """
+    Bag-of-words-like data.  (The inverse solve already takes over a
+    minute at this size.)
+    """
+    rng = np.random.RandomState(seed)
+    X = sp.random(N, d, density=density, format='csc', random_state=rng)
+    y = rng.randint(0, C, size=N)
+    return X, y
+
+
+def benchmark_ridge(X, y, lam, sparse, data_name,
+                    solvers=('factorize', 'inverse')):
+    rows = []
+    weights = {}
+    for solver in solvers:
+        model = RidgeMulti(X=X, y=y, lam=lam, sparse=sparse, solver=solver)
+        W, seconds, peak_MB = measure(model.optimize)
+        weights[solver] = W.toarray() if sp.issparse(W) else W
+        rows.append({"data": data_name, "N": X.shape[0], "d": X.shape[1],
+                     "sparse": sparse, "solver": solver,
+                     "seconds": seconds, "peak MB": peak_MB})
+    # the two solvers should agree.
+    for row in rows:
+        row["max |W - W(first solver)|"] = \
+            np.absolute(weights[row["solver"]] - weights[solvers[0]]).max()
+    return rows
+
+
+def run_benchmarks(lam=1., filename='ridge_benchmark'):
+    rows = []
+    X, y = mnist_sized_data()
+    rows += benchmark_ridge(X, y, lam, sparse=False,
+                            data_name='MNIST-sized, dense')
+    rows += benchmark_ridge(X, y, lam, sparse=True,
+                            data_name='MNIST-sized, scipy.sparse')
+    X, y = wide_sparse_data()
+    rows += benchmark_ridge(X, y, lam, sparse=True,
+                            data_name='wide sparse')
+    results = pd.DataFrame(rows)
+    results.to_csv(filename + '.csv', index=False)
+    return results
+
+
+if __name__ == '__main__':
+    print(run_benchmarks())
@@ -39,6 +39,7 @@ class LogisticRegression(ClassificationBase):
         self.progress_monitoring_freq = progress_monitoring_freq
         self.num_passes_through_N_pts = 0
         self.points_sampled = 0
+        self.buffer = None  # reused n x C work space for the softmax
 
     def apply_weights(self, X):
         """
@@ -48,42 +49,71 @@ class LogisticRegression(ClassificationBase):
         """
         return X.dot(self.get_weights())
 
-    def probability_array(self, X):
+    def score_buffer(self, n):
+        """
+        An n x C array to work the softmax out in, reused between calls
+        with the same n (e.g. every minibatch, every full-data evaluation).
+        """
+        if self.buffer is None or self.buffer.shape != (n, self.C):
+            self.buffer = np.empty((n, self.C))
+        return self.buffer
+
+    def shifted_scores(self, X, out):
+        """
+        Fill out with XW minus each row's max.  Softmax doesn't change when
+        a row is shifted, and afterwards the largest exponent is exp(0), so
+        big weights (large learning rates) can't overflow to inf/NaN.
+        """
+        W = self.get_weights()
+        if isinstance(X, np.ndarray) and out.dtype == np.result_type(X, W):
+            np.dot(X, W, out=out)
+        else:
+            out[:] = self.apply_weights(X)
+        out -= out.max(axis=1)[:, np.newaxis]
+        return out
+
+    def probability_array(self, X, out=None):
         """
         Calculate the array of probabilities.
-        :return: An Nx1 array.
+        :param out: n x C array to write them into.  A new one if None.
+        :return: An nxC array.
         """
         n = X.shape[0]
-        R = np.exp(self.apply_weights(X))
-        if R.shape[0] != n:
-            print("R has shape {}".format(R.shape))
-        assert R.shape[0] == n, "X dot W has dim {}".format(R.shape)
-        # When you sum across a row, axis=1
-        R_sum_ax1 = np.sum(R, axis=1)
-        R_sum_ax1 = np.reshape(R_sum_ax1, newshape=(n, 1))
-        assert R_sum_ax1.shape == (n, 1)
-
-        # Divide each element in R by
-        return R/R_sum_ax1
+        if out is None:
+            out = np.empty((n, self.C))
+        assert out.shape == (n, self.C), "out has shape {}".format(out.shape)
+        P = self.shifted_scores(X, out)
+        np.exp(P, out=P)
+        P /= P.sum(axis=1)[:, np.newaxis]
+        return P
 
     def predict(self):
         """
         Produce an array of class predictions
         """
-        probabilities = self.probability_array(self.X)
+        probabilities = self.probability_array(
+            self.X, out=self.score_buffer(self.N))
         # THIS ASSUMES the classifiers are in order: 0th column of the
         # probabilities corresponds to label = 0, ..., 9th col is for 9.
         classes = np.argmax(probabilities, axis=1)
         return classes
 
-    def log_loss(self, X, Y):
-        probabilities = self.probability_array(X).copy()
-        # get just the probability for the correct label.
-        probabilities = np.multiply(Y, probabilities)
-        # collapse it into an Nx1 array:
-        probabilities = np.amax(probabilities, axis=1)
+    def log_loss(self, X, Y, y=None):
+        """
+        Sum of log(probability of the correct label), via
+        log p_i = (q_i,y_i - max_j q_ij) - log(sum_j exp(q_ij - max_j q_ij)).
+        Picks out the correct label's score by index, so there's no n x C
+        mask multiply, and never takes the log of an underflowed 0.
 
-        return np.log(probabilities).sum()
+        :param y: labels (n, ) or (n, 1).  Found from one-hot Y if None.
+        """
+        n = X.shape[0]
+        labels = np.argmax(Y, axis=1) if y is None else y
+        labels = np.ravel(np.asarray(labels)).astype(int)
+        scores = self.shifted_scores(X, self.score_buffer(n))
+        correct = scores[np.arange(n), labels]
+        np.exp(scores, out=scores)
+        return (correct - np.log(scores.sum(axis=1))).sum()
 
     def grad_desc(self):
         # break data into chunks:
@@ -96,11 +126,11 @@ class LogisticRegression(ClassificationBase):
         """
         n, d = X.shape
         assert n == Y.shape[0]
-        P = self.probability_array(X)
-        E = Y - P  # prediction error for each class (column). (0 to 1)
+        P = self.probability_array(X, out=self.score_buffer(n))
+        P -= Y  # -(prediction error) for each class (column). (0 to 1)
 
         # TODO: scale eta by batch size.
-        self.W += (self.eta/self.N)*(-self.lam_norm*self.W + X.T.dot(E)/n)
+        self.W += (self.eta/self.N)*(-self.lam_norm*self.W - X.T.dot(P)/n)
         assert self.W.shape == (self.d ,self.C), \
             "shape of W is {}".format(self.W.shape)
         self.iteration += 1
@@ -116,13 +146,13 @@ class LogisticRegression(ClassificationBase):
         results_row = super(LogisticRegression, self).results_row()
 
         # append on logistic regression-specific results
-        neg_log_loss = -self.log_loss(self.X, self.Y)
+        neg_log_loss = -self.log_loss(self.X, self.Y, self.y)
         more_details = {
             "lambda":[self.lam],
             "lambda normalized":[self.lam_norm],
             "eta0":[self.eta0],
             "eta": [self.eta],  # learning rate
-            "log loss": [self.log_loss(self.X, self.Y)],
+            "log loss": [-neg_log_loss],
             "-(log loss), training": [neg_log_loss],
             "-(log loss)/N, training": [neg_log_loss/self.N],
             "iteration": [self.iteration],
@@ -163,7 +193,7 @@ class LogisticRegression(ClassificationBase):
             # Don't compute loss every time; expensive!
             # TODO: move this into the loop below and get log_loss from the
             # Pandas result so I don't compute it extra times.  (Expensive!)
-            old_neg_log_loss_norm = -self.log_loss(self.X, self.Y)/self.N
+            old_neg_log_loss_norm = -self.log_loss(self.X, self.Y, self.y)/self.N
 
             # loop over ~all of the data points in little batches.
             while num_pts < self.N:
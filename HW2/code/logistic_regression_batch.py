@@ -1,6 +1,7 @@
 import numpy as np
 import sys
 import pandas as pd
+from scipy.special import expit
 
 import matplotlib.pyplot as plt
 
@@ -8,15 +9,67 @@ from classification_base import ClassificationBase
 from classification_base import ModelFitExcpetion
 
 
+def backtracking_line_search(objective, theta, f, g, direction, step=1.,
+                             shrink=0.5, c=1e-4, max_shrinks=50):
+    """
+    Shrink the step along direction until the objective decreases enough
+    (the Armijo condition f(theta + t*d) <= f + c*t*g.d).
+
+    The accepted point is always the last one objective() was called on,
+    so a model that caches its margins in objective() has them ready for
+    the gradient at the new point.
+
+    :return: (step, new theta, objective at new theta)
+    """
+    slope = g.dot(direction)
+    assert slope < 0, "not a descent direction"
+    for _ in range(max_shrinks):
+        theta_new = theta + step*direction
+        f_new = objective(theta_new)
+        if f_new <= f + c*step*slope:
+            return step, theta_new, f_new
+        step *= shrink
+    raise ModelFitExcpetion("line search couldn't decrease the loss")
+
+
+def lbfgs_direction(g, s_history, y_history):
+    """
+    L-BFGS two-loop recursion: -H g for the inverse Hessian approximation H
+    built from the last few steps s = theta_new - theta and gradient
+    changes y = g_new - g.  Plain -g if there's no history yet.
+    """
+    q = g.copy()
+    rhos = [1./y.dot(s) for s, y in zip(s_history, y_history)]
+    alphas = []
+    for s, y, rho in reversed(list(zip(s_history, y_history, rhos))):
+        alpha = rho*s.dot(q)
+        q -= alpha*y
+        alphas.append(alpha)
+    if s_history:
+        # scale by the most recent curvature estimate
+        q *= s_history[-1].dot(y_history[-1])/ \
+            y_history[-1].dot(y_history[-1])
+    for (s, y, rho), alpha in zip(zip(s_history, y_history, rhos),
+                                  reversed(alphas)):
+        beta = rho*y.dot(q)
+        q += (alpha - beta)*s
+    return -q
+
+
 class LogisticRegressionBatch(ClassificationBase):
     """
     Train *one* model.
     """
     def __init__(self, X, y, eta0, lam, W=None, max_iter=10**6,
                  delta_percent=1e-3, verbose=False,
-                 test_X=None, test_y=None): #
+                 test_X=None, test_y=None,
+                 solver='gd', lbfgs_memory=10): #
         '''
         No bias!
+
+        solver: 'gd' for fixed-step gradient descent with a shrinking eta,
+        'line search' for gradient descent with backtracking line search,
+        or 'lbfgs'.  The last two ignore eta0.
         '''
         # call the base class's methods first
         super(LogisticRegressionBatch, self).__init__(X=X, y=y, W=W)
@@ -30,29 +83,44 @@ class LogisticRegressionBatch(ClassificationBase):
         self.verbose=verbose
         self.test_X = test_X
         self.test_y = test_y
+        assert solver in ('gd', 'line search', 'lbfgs')
+        self.solver = solver
+        self.lbfgs_memory = lbfgs_memory
+        self.q = None  # margins for the current weights; see apply_weights
+
+    def replace_X_and_y(self, X, y):
+        super(LogisticRegressionBatch, self).replace_X_and_y(X, y)
+        self.q = None
 
     def apply_weights(self):
         """
         calc XW.  No bias.
         This quantity is labeled q in my planning.
+        Computed once per set of weights and shared by the loss, gradient,
+        probabilities and predictions; anything that changes the weights
+        sets self.q = None.
         :return: vector of Weights applied to X.
         """
-        return self.X.dot(self.get_weights())
+        if self.q is None:
+            self.q = self.X.dot(self.get_weights())
+        return self.q
+
+    def shifted_margins(self):
+        """
+        q minus each row's max, so exp() can't overflow.
+        """
+        q = self.apply_weights()
+        return q - q.max(axis=1)[:, np.newaxis]
 
     def probability_array(self):
         """
         Calculate the array of probabilities.
-        :return: An Nx1 array.
+        :return: An NxC array.
         """
-        R = np.exp(self.apply_weights())
+        R = np.exp(self.shifted_margins())
         assert R.shape == (self.N, self.C)
-        # When you sum across a row, axis=1
-        R_sum_ax1 = np.sum(R, axis=1)
-        R_sum_ax1 = np.reshape(R_sum_ax1, newshape=(self.N, 1))
-        assert R_sum_ax1.shape == (self.N, 1)
-
-        # Divide each element in R by
-        return R/R_sum_ax1
+        R /= R.sum(axis=1)[:, np.newaxis]
+        return R
 
     def predict(self):
         """
@@ -65,13 +133,40 @@ class LogisticRegressionBatch(ClassificationBase):
         return classes
 
     def log_loss(self):
-        probabilities = self.probability_array().copy()
-        # get just the probability for the correct label.
-        probabilities = np.multiply(self.Y, probabilities)
-        # collapse it into an Nx1 array:
-        probabilities = np.amax(probabilities, axis=1)
+        """
+        Sum of log(probability of the correct label), as a log-sum-exp of
+        the margins.
+        """
+        S = self.shifted_margins()
+        labels = np.ravel(self.y).astype(int)
+        correct = S[np.arange(self.N), labels]
+        return (correct - np.log(np.exp(S).sum(axis=1))).sum()
 
-        return np.log(probabilities).sum()
+    def get_params(self):
+        """
+        The weights as one flat vector, for the line search solvers.
+        """
+        return self.W.ravel().copy()
+
+    def set_params(self, theta):
+        self.W = theta.reshape(self.d, self.C).copy()
+        self.q = None
+
+    def objective(self, theta):
+        """
+        Move to theta and return the regularized -(log loss) there.
+        Leaves the margins cached for gradient().
+        """
+        self.set_params(theta)
+        W = self.get_weights()
+        return -self.log_loss() + 0.5*self.lam_norm*np.multiply(W, W).sum()
+
+    def gradient(self):
+        """
+        Gradient of objective() at the current weights, as a flat vector.
+        """
+        E = self.Y - self.probability_array()
+        return (self.lam_norm*self.W - self.X.T.dot(E)).ravel()
 
     def step(self):
         """
@@ -84,6 +179,7 @@ class LogisticRegressionBatch(ClassificationBase):
         self.W += self.eta*(-self.lam_norm*self.W + self.X.T.dot(E))
         assert self.W.shape == (self.d ,self.C), \
             "shape of W is {}".format(self.W.shape)
+        self.q = None
         self.iteration += 1
 
     def shrink_eta(self, s, s_exp=0.5):
@@ -102,16 +198,106 @@ class LogisticRegressionBatch(ClassificationBase):
             "lambda":[self.lam],
             "lambda normalized":[self.lam_norm],
             "eta0":[self.eta0],
-            "eta": [self.eta],  # learning rate
-            "log loss": [self.log_loss()],
+            "eta": [self.eta],  # learning rate (accepted step if searching)
+            "log loss": [-neg_log_loss],
             "-(log loss), training": [neg_log_loss],
             "-(log loss)/N, training": [neg_log_loss/self.N],
-            "iteration": [self.iteration]
+            "iteration": [self.iteration],
+            "solver": [self.solver]
             }
         results_row.update(more_details)
         return results_row
 
+    def record_iteration(self, results_row, neg_log_loss_percent_change):
+        results_row['log loss percent change'] = neg_log_loss_percent_change
+        one_val = pd.DataFrame(results_row)
+
+        # HW2 asks for us to plot the log loss of the test data (which
+        # we are't touching during training!)
+        if self.test_X is not None:
+            test_results = \
+                pd.DataFrame(self.apply_model(X=self.test_X, y=self.test_y,
+                                              data_name = 'testing'))
+            t_columns = [c for c in test_results.columns
+                         if 'test' in c or 'lambda' == c]
+            one_val = pd.merge(one_val, test_results[t_columns])
+
+        self.results = pd.concat([self.results, one_val])
+
+    def run_line_search(self):
+        """
+        Full-batch descent with a backtracking line search, along -gradient
+        ('line search') or the L-BFGS direction ('lbfgs').
+
+        Each objective evaluation caches the margins q, and the accepted
+        point is the last one evaluated, so the gradient, log loss, and
+        0/1 loss for the new weights don't recompute X.dot(W).
+        """
+        theta = self.get_params()
+        f = self.objective(theta)
+        g = self.gradient()
+        s_history, y_history = [], []
+        step = 1./max(np.linalg.norm(g), 1.)
+
+        for s in range(1, self.max_iter+1):
+            old_neg_log_loss_norm = -self.log_loss()/self.N
+
+            if self.solver == 'lbfgs':
+                direction = lbfgs_direction(g, s_history, y_history)
+                if g.dot(direction) >= 0:
+                    # lost positive definiteness; restart from -gradient.
+                    s_history, y_history = [], []
+                    direction = -g
+            else:
+                direction = -g
+            # L-BFGS steps are scaled already; otherwise start a bit
+            # longer than the last step that worked.
+            if self.solver == 'lbfgs' and s_history:
+                step = 1.
+            elif s > 1:
+                step = 2*step
+
+            theta_old, g_old = theta, g
+            step, theta, f = backtracking_line_search(
+                self.objective, theta, f, g, direction, step=step)
+            self.eta = step
+            g = self.gradient()
+            self.iteration += 1
+            sys.stdout.write(".")
+
+            if self.solver == 'lbfgs':
+                s_k, y_k = theta - theta_old, g - g_old
+                # only keep pairs with positive curvature
+                if s_k.dot(y_k) > 1e-10:
+                    s_history.append(s_k)
+                    y_history.append(y_k)
+                    if len(s_history) > self.lbfgs_memory:
+                        s_history.pop(0)
+                        y_history.pop(0)
+
+            results_row = self.results_row()
+            new_neg_log_loss_norm = results_row['-(log loss)/N, training'][0]
+            if self.verbose:
+                if s%5== 0: print(new_neg_log_loss_norm)
+
+            neg_log_loss_percent_change = \
+                (new_neg_log_loss_norm - old_neg_log_loss_norm)/ \
+                old_neg_log_loss_norm*100
+            self.record_iteration(results_row, neg_log_loss_percent_change)
+
+            if abs(neg_log_loss_percent_change) < self.delta_percent:
+                print("Loss optimized.  Old/N: {}, new/N:{}. Step: {}".format(
+                    old_neg_log_loss_norm, new_neg_log_loss_norm, self.eta))
+                break
+
+            if s == self.max_iter:
+                print('max iterations ({}) reached.'.format(self.max_iter))
+
+        self.results.reset_index(drop=True, inplace=True)
+
     def run(self):
+        if self.solver != 'gd':
+            return self.run_line_search()
 
         num_diverged_steps = 0
         fast_convergence_steps = 0
@@ -135,20 +321,7 @@ class LogisticRegressionBatch(ClassificationBase):
                 (new_neg_log_loss_norm - old_neg_log_loss_norm)/ \
                 old_neg_log_loss_norm*100
 
-            results_row['log loss percent change'] = neg_log_loss_percent_change
-            one_val = pd.DataFrame(results_row)
-
-            # TODO: also find the log loss & 0/1 loss using test data.
-            # HW2 asks for us to plot the log loss of the test data (which
-            # we are't touching during training!)
-            test_results = \
-                pd.DataFrame(self.apply_model(X=self.test_X, y=self.test_y,
-                                              data_name = 'testing'))
-            t_columns = [c for c in test_results.columns
-                         if 'test' in c or 'lambda' == c]
-            one_val = pd.merge(one_val, test_results[t_columns])
-
-            self.results = pd.concat([self.results, one_val])
+            self.record_iteration(results_row, neg_log_loss_percent_change)
 
             # TODO: these convergence steps aren't really tested!
             if neg_log_loss_percent_change > 0:
@@ -211,7 +384,8 @@ class LogisticRegressionBinaryBatch(LogisticRegressionBatch):
     Train *one* model.
     """
     def __init__(self, X, y, test_X, test_y, eta0, lam, w=None, w0=None,
-                 max_iter=10**6, delta_percent=1e-3, verbose=False):
+                 max_iter=10**6, delta_percent=1e-3, verbose=False,
+                 solver='gd', lbfgs_memory=10):
 
         self.binary = True
         # Stuff that would be in a base class:
@@ -252,6 +426,10 @@ class LogisticRegressionBinaryBatch(LogisticRegressionBatch):
         self.verbose=verbose
         self.test_X = test_X
         self.test_y = test_y
+        assert solver in ('gd', 'line search', 'lbfgs')
+        self.solver = solver
+        self.lbfgs_memory = lbfgs_memory
+        self.q = None
 
     def get_weights(self):
         """
@@ -263,10 +441,12 @@ class LogisticRegressionBinaryBatch(LogisticRegressionBatch):
         """
         calc w0 + Xw
         This quantity is labeled q in my planning.
+        Cached until the weights change, like the parent's.
         :return: vetor of weights applied to X.
         """
-        w0_array = np.ones(self.N)*self.w0
-        return w0_array + self.X.dot(self.w)
+        if self.q is None:
+            self.q = self.X.dot(self.w) + self.w0
+        return self.q
 
     def pred_to_01_loss(self, class_calls):
         """
@@ -281,8 +461,8 @@ class LogisticRegressionBinaryBatch(LogisticRegressionBatch):
         Calculate the array of probabilities.
         :return: An Nx1 array.
         """
-        q = self.apply_weights()
-        return np.exp(q)/(1 + np.exp(q))
+        # expit(q) = exp(q)/(1 + exp(q)), without overflow for large q.
+        return expit(self.apply_weights())
 
     def predict(self, threshold=0.5):
         """
@@ -295,16 +475,38 @@ class LogisticRegressionBinaryBatch(LogisticRegressionBatch):
         return classes
 
     def log_loss(self):
+        """
+        Overwrite the parent class.
+        log P(y|x) = y*q - log(1 + exp(q)), for y in {0, 1}.
+        """
+        q = self.apply_weights()
+        return (self.y*q - np.logaddexp(0, q)).sum()
+
+    def get_params(self):
+        """
+        Overwrite the parent class: [w0, w].
+        """
+        return np.concatenate([[self.w0], self.w])
+
+    def set_params(self, theta):
+        self.w0 = theta[0]
+        self.w = theta[1:].copy()
+        self.q = None
+
+    def objective(self, theta):
+        """
+        Overwrite the parent class.  The bias isn't regularized.
+        """
+        self.set_params(theta)
+        return -self.log_loss() + 0.5*self.lam_norm*self.w.dot(self.w)
+
+    def gradient(self):
         """
         Overwrite the parent class.
         """
-        probabilities = self.probability_array().copy()
-        # need to flip the probabilities for p < 0.5 with this binary case.
-        # 1 - old_val is same as oldval*-1 + 1.  Do in 2 steps:
-        probabilities[np.equal(0, self.y)] *= -1
-        probabilities[np.equal(0, self.y)] += 1
-        # when multiclass: np.amax(probabilities, 1)
-        return np.log(probabilities).sum()
+        E = self.y - self.probability_array()
+        return np.concatenate([[-E.sum()],
+                               self.lam_norm*self.w - self.X.T.dot(E)])
 
     def step(self):
         """
@@ -321,4 +523,5 @@ class LogisticRegressionBinaryBatch(LogisticRegressionBatch):
         self.w += self.eta*(-self.lam_norm*self.w + self.X.T.dot(E))
         assert self.w.shape == (self.d ,), \
             "shape of w is {}".format(self.w.shape)
+        self.q = None
         self.iteration += 1
\ No newline at end of file
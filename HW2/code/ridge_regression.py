@@ -1,5 +1,7 @@
+import hashlib
 import numpy as np
 import pandas as pd
+import scipy.linalg as linalg
 import scipy.sparse as sp
 import scipy.sparse.linalg as splin
 
@@ -8,15 +10,236 @@ import time;
 
 from classification_base import ClassificationBase
 
+
+def solve_normal_equations(A, B, dense_fraction=0.1):
+    """
+    Solve A W = B for the symmetric positive definite A = lam*I + X^T X
+    without forming A^(-1).
+
+    A mostly filled-in A (e.g. MNIST pixels) gets a dense Cholesky
+    factorization; a sparse one (e.g. bag of words) gets a sparse LU with
+    a symmetric fill-reducing ordering.
+    """
+    if sp.issparse(B):
+        B = B.toarray()
+    if sp.issparse(A) and A.nnz < dense_fraction*A.shape[0]**2:
+        lu = splin.splu(sp.csc_matrix(A), permc_spec='MMD_AT_PLUS_A')
+        return lu.solve(B)
+    if sp.issparse(A):
+        A = A.toarray()
+    return linalg.cho_solve(linalg.cho_factor(A), B)
+
+
+def conjugate_gradient(apply_A, B, W0=None, tol=1e-6, max_iter=None):
+    """
+    Solve A W = B for symmetric positive definite A, one CG run per column
+    of B, all columns updated together.  A is only touched through
+    apply_A(P) = A.dot(P), so it never has to be formed.
+
+    :param W0: starting guess (warm start).
+    :param tol: stop once ||B - AW|| <= tol*||B|| for every column.
+    :return: (W, number of iterations)
+    """
+    B = B.toarray() if sp.issparse(B) else np.asarray(B, dtype=float)
+    if max_iter is None:
+        max_iter = B.shape[0]
+    W = np.zeros(B.shape) if W0 is None else np.array(W0, dtype=float)
+    R = B - apply_A(W)
+    P = R.copy()
+    rs = np.multiply(R, R).sum(axis=0)
+    b_norms = np.sqrt(np.multiply(B, B).sum(axis=0))
+    b_norms[b_norms == 0] = 1.
+
+    iteration = 0
+    while iteration < max_iter:
+        active = np.sqrt(rs) > tol*b_norms
+        if not active.any():
+            break
+        AP = apply_A(P)
+        pAp = np.multiply(P, AP).sum(axis=0)
+        # columns that already converged get a step of 0.
+        alpha = np.zeros_like(rs)
+        np.divide(rs, pAp, out=alpha, where=active & (pAp > 0))
+        W += P*alpha
+        R -= AP*alpha
+        rs_new = np.multiply(R, R).sum(axis=0)
+        beta = np.zeros_like(rs)
+        np.divide(rs_new, rs, out=beta, where=active)
+        P = R + P*beta
+        rs = rs_new
+        iteration += 1
+    return W, iteration
+
+def threshold_sweep(y_preds, truth):
+    """
+    Confusion counts, 0/1 loss and ROC/PR points for every threshold at
+    once.  A point is called positive when its prediction is > threshold.
+
+    Sorting the predictions once puts every possible set of positive calls
+    in order, so the counts for all thresholds are cumulative sums instead
+    of one predict(threshold) call per cutoff.
+
+    :param y_preds: predictions, shape (N, ).
+    :param truth: 0/1 labels, shape (N, ) or (N, 1); may be scipy.sparse.
+    :return: DataFrame with one row per distinct threshold, from
+        "everything negative" to "everything positive".
+    """
+    if hasattr(truth, 'toarray'):
+        truth = truth.toarray()
+    truth = np.ravel(truth).astype(bool)
+    y_preds = np.ravel(y_preds)
+    N = len(truth)
+    assert y_preds.shape == (N, )
+
+    order = np.argsort(-y_preds, kind='mergesort')
+    preds = y_preds[order]
+    # calling the first k sorted points positive, for each k
+    true_pos = np.concatenate([[0], np.cumsum(truth[order])])
+    false_pos = np.arange(N + 1) - true_pos
+
+    # only keep k where the next prediction differs: ties can't be split.
+    k = np.concatenate([[0], np.flatnonzero(np.diff(preds)) + 1, [N]])
+    # "> threshold" for the first k points only: use the k-th prediction.
+    threshold = np.concatenate([preds, [-np.inf]])[k]
+    true_pos = true_pos[k]
+    false_pos = false_pos[k]
+    positives = truth.sum()
+    false_neg = positives - true_pos
+    true_neg = (N - positives) - false_pos
+
+    called_pos = true_pos + false_pos
+    loss_01 = false_pos + false_neg
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            "threshold": threshold,
+            "true + count": true_pos,
+            "true - count": true_neg,
+            "false + count": false_pos,
+            "false - count": false_neg,
+            "loss_01": loss_01,
+            "loss_01_norm": loss_01/N,
+            "true positive rate": true_pos/positives,
+            "false positive rate": false_pos/(N - positives),
+            # precision is 1 when nothing is called positive.
+            "precision": np.where(called_pos > 0, true_pos/called_pos, 1.),
+            "recall": true_pos/positives})
+
+
+
+class GramMatrixCache(object):
+    """
+    The N x N Gram matrix K = XX^T for kernelized ridge, built once and
+    eigendecomposed once.  With K = Q diag(e) Q^T,
+        (K + lambda*I)^(-1) = Q diag(1/(e + lambda)) Q^T
+    so every new lambda costs a couple of N x N x C products instead of a
+    new N x N inverse.
+    """
+    def __init__(self, X, block_size=1000, filename=None, verbose=False):
+        """
+        :param block_size: K is filled in this many rows at a time, so the
+         only full N x N arrays are K and its eigenvectors.
+        :param filename: if given, K is a np.memmap at this path instead
+         of living in memory.
+        """
+        self.X = sp.csr_matrix(X) if sp.issparse(X) else np.asarray(X)
+        self.N = self.X.shape[0]
+        self.block_size = block_size
+        self.filename = filename
+        self.verbose = verbose
+        self.K = None
+        self.eigenvalues = None
+        self.eigenvectors = None
+        self.QtY = None
+        self.Y_key = None  # contents_key of the Y that QtY was computed for
+
+    def gram_matrix(self):
+        if self.K is not None:
+            return self.K
+        if self.filename is not None:
+            self.K = np.memmap(self.filename, dtype=np.float64, mode='w+',
+                               shape=(self.N, self.N))
+        else:
+            self.K = np.empty((self.N, self.N))
+        XT = self.X.T
+        for start in range(0, self.N, self.block_size):
+            stop = min(start + self.block_size, self.N)
+            block = self.X[start:stop].dot(XT)
+            self.K[start:stop] = block.toarray() if sp.issparse(block) \
+                else block
+        if self.verbose:
+            print("built {0} x {0} Gram matrix: {1}".format(
+                self.N, time.asctime(time.localtime(time.time()))))
+        return self.K
+
+    def eigendecompose(self):
+        if self.eigenvalues is None:
+            e, self.eigenvectors = np.linalg.eigh(self.gram_matrix())
+            # K is PSD; clip the round-off negatives.
+            self.eigenvalues = np.maximum(e, 0)
+            if self.verbose:
+                print("eigendecomposed Gram matrix: {}".format(
+                    time.asctime(time.localtime(time.time()))))
+        return self.eigenvalues, self.eigenvectors
+
+    @staticmethod
+    def contents_key(Y):
+        """
+        Identify Y by its shape, dtype and a hash of its values, so equal
+        label matrices built by different models (e.g. every model of a
+        lambda sweep) share Q^T Y.  Hashing is O(NC), next to Q^T Y's
+        O(N^2 C).
+        """
+        return (Y.shape, Y.dtype.str, hashlib.sha1(Y).hexdigest())
+
+    def dual_coefficients(self, Y, lam):
+        """
+        alpha = (K + lambda*I)^(-1) Y, an N x C array.
+        """
+        assert lam > 0, "need lambda > 0 for the kernelized solve."
+        e, Q = self.eigendecompose()
+        # Q^T Y doesn't depend on lambda.
+        Y = np.ascontiguousarray(Y.toarray() if sp.issparse(Y) else Y)
+        key = self.contents_key(Y)
+        if self.QtY is None or self.Y_key != key:
+            self.QtY = Q.T.dot(Y)
+            self.Y_key = key
+        return Q.dot(self.QtY/(e + lam)[:, np.newaxis])
+
+    def weights(self, Y, lam):
+        """
+        W = X^T alpha, a d x C array.
+        """
+        return np.asarray(self.X.T.dot(self.dual_coefficients(Y, lam)))
+
+    def predict(self, X_new, Y, lam):
+        """
+        Yhat for new rows.  The cross kernel X_new X^T is never built: for
+        the linear kernel (X_new X^T) alpha = X_new (X^T alpha) = X_new W.
+        """
+        return np.asarray(X_new.dot(self.weights(Y, lam)))
+
+
 class RidgeMulti(ClassificationBase):
     """
     Train multiple ridge models.
     """
     def __init__(self, X, y, lam, W=None, verbose=False, sparse=True,
-                 test_X=None, test_y = None, kernelized=False):
+                 test_X=None, test_y = None, kernelized=False,
+                 solver='factorize', tol=1e-6, max_cg_iter=None,
+                 gram_cache=None):
         """
         test_X, test_y are for compatibility only, because the questions for
          other methods require knowing test data during fitting.
+
+        solver: 'factorize' solves (X^TX + lambdaI)W = X^TY with a
+         Cholesky/LU factorization.  'inverse' is the original explicit
+         inverse, kept for comparison.  'cg' uses conjugate gradient and
+         only ever multiplies by X and X^T, for feature maps too big for a
+         d x d or N x N matrix.  W, if given, is the CG starting point.
+        tol, max_cg_iter: CG stopping rules.
+        gram_cache: a GramMatrixCache for this X.  The kernelized solve
+         then reuses its eigendecomposition; share one cache between the
+         models of a lambda sweep.
         """
         super(RidgeMulti, self).__init__(X=X, y=y, W=W, sparse=sparse)
         self.sparse = sparse
@@ -25,40 +248,82 @@ class RidgeMulti(ClassificationBase):
             self.X = sp.csc_matrix(self.X)
             self.Y = sp.csc_matrix(self.Y)
         self.lam = lam
+        self.W_warm_start = W
         self.W = None # don't want to have W before solving!
+        self.Yhat = None  # XW; dropped whenever W or X is assigned
         self.matrix_work = None
         self.verbose = verbose
         self.kernelized = kernelized
+        assert solver in ('factorize', 'inverse', 'cg')
+        self.solver = solver
+        self.tol = tol
+        self.max_cg_iter = max_cg_iter
+        self.cg_iterations = None
+        if gram_cache is not None:
+            assert gram_cache.N == self.N, "Gram matrix is for different X"
+        self.gram_cache = gram_cache
+
+    def __setattr__(self, name, value):
+        """
+        Yhat = XW is cached, so assigning W or X drops it, including
+        direct assignments like HyperparameterExplorer's m.W = ....
+
+        Ridge weights are dense even when X is sparse, so W is always kept
+        as a dense array: X.dot(W) is then one sparse-dense product that
+        returns an array, with no sparse result to convert back.
+        """
+        if name == 'W' and sp.issparse(value):
+            value = value.toarray()
+        if name in ('W', 'X'):
+            self.__dict__['Yhat'] = None
+        super(RidgeMulti, self).__setattr__(name, value)
 
     def get_weights(self):
-        if self.sparse:
-            return self.W.toarray()
-        if not self.sparse:
-            return self.W
+        return self.W
 
-    def apply_weights(self):
-        if self.verbose:
-            print("Apply weights to H(X): {}".format(time.asctime(time.localtime(time.time()))))
-        # Apply weights
-        if self.sparse:
-            assert type(self.W) == sp.csc_matrix or type(self.W) == sp.csr_matrix, \
-                "type of W is {}".format(type(self.W))
-            assert type(self.X) == sp.csc_matrix, \
-                "type of W is {}".format(type(self.X))
+    def set_weights(self, W):
+        self.W = W if sp.issparse(W) else np.asarray(W)
+        assert self.W.shape == (self.d, self.C)
 
-            prod = self.X.dot(self.W)
+    def apply_weights(self):
+        """
+        Yhat = XW, computed once per W and X and shared by predict,
+        loss_01, sse and rmse.
+        """
+        if self.Yhat is None:
             if self.verbose:
-                print("Done applying weights to H(X): {}".format(time.asctime(time.localtime(time.time()))))
-            if type(prod) == sp.csc_matrix:
-                return prod.toarray()
-            else:
-                return prod
-        else:
+                print("Apply weights to H(X): {}".format(time.asctime(time.localtime(time.time()))))
+            Yhat = self.X.dot(self.W)
+            if sp.issparse(Yhat):
+                Yhat = Yhat.toarray()
+            self.Yhat = np.asarray(Yhat)
             if self.verbose:
                 print("Done applying weights to H(X): {}".format(time.asctime(time.localtime(time.time()))))
-            return self.X.dot(self.W)
+        return self.Yhat
+
+    def cg_optimize(self):
+        """
+        Solve (X^TX + lambdaI)W = X^TY with conjugate gradient, without
+        forming X^TX.  Starts from the last solution (or the W passed in).
+        """
+        def apply_A(P):
+            return self.X.T.dot(self.X.dot(P)) + self.lam*P
+
+        W0 = self.W if self.W is not None else self.W_warm_start
+        if sp.issparse(W0):
+            W0 = W0.toarray()
+        W, self.cg_iterations = conjugate_gradient(
+            apply_A, self.X.T.dot(self.Y), W0=W0, tol=self.tol,
+            max_iter=self.max_cg_iter)
+        if self.verbose:
+            print("CG finished after {} iterations.".format(
+                self.cg_iterations))
+        self.set_weights(W)
+        return self.W
 
     def optimize(self):
+        if self.solver == 'cg':
+            return self.cg_optimize()
         # When solving multiclass, (X^TX + lambdaI)-1X^T is shared
         # solve it once and share it with all the regressors.
         # find lambda*I_D + X^T*X
@@ -72,6 +337,18 @@ class RidgeMulti(ClassificationBase):
             piece_to_invert = np.identity(self.d)*self.lam + self.X.T.dot(self.X)
         assert piece_to_invert.shape == (self.d, self.d)
 
+        if self.solver == 'factorize':
+            # Solve (X^TX + lambdaI)W = X^TY for all C classes at once.
+            # Never forms the inverse or the d x N matrix_work.
+            if self.verbose:
+                print("factorize and solve for the {} classifiers: {}".format(
+                    self.C, time.asctime(time.localtime(time.time()))))
+            W = solve_normal_equations(piece_to_invert, self.X.T.dot(self.Y))
+            self.set_weights(W)
+            if self.verbose:
+                print("done generating weights.")
+            return self.W
+
         # Invert (X^TX + lambdaI)
         if self.verbose:
             print("invert matrix:")
@@ -91,23 +368,32 @@ class RidgeMulti(ClassificationBase):
         if self.verbose:
             print("train the {} classifiers:".format(self.C))
         # Train C classifiers.
-        self.W = self.matrix_work.dot(self.Y)
+        self.set_weights(self.matrix_work.dot(self.Y))
         if self.verbose:
             print("done generating weights.")
-        assert self.W.shape == (self.d, self.C)
         return self.W
 
     def kernelized_optimize(self):
         # fact: H^T(HH^T + lambda*I_N) == (lambda*I_d + H^TH)H^T
-        # instead of inverting a dxd matrix, we invert an nxn matrix.
+        # instead of solving a dxd system, we solve an nxn one.
         # So our ridge formula becomes:
         # (lambda*I_d + H^TH)^(-1)H^T = H^T(HH^T + lambdaI_N)^(-1)
+        if self.gram_cache is not None:
+            self.set_weights(self.gram_cache.weights(self.Y, self.lam))
+            return self.W
+
         if self.sparse:
             piece_to_invert = self.X.dot(self.X.T) + sp.identity(self.N)*self.lam 
         else:
             piece_to_invert = self.X.dot(self.X.T) + np.identity(self.N)*self.lam 
         assert piece_to_invert.shape == (self.N, self.N) # yay!
 
+        if self.solver != 'inverse':
+            # alpha = (HH^T + lambda*I)^(-1)Y, by factorization.
+            alpha = solve_normal_equations(piece_to_invert, self.Y)
+            self.set_weights(self.X.T.dot(alpha))
+            return self.W
+
         # invert this NxN matrix.
         if self.verbose:
             print("invert matrix:")
@@ -122,10 +408,10 @@ class RidgeMulti(ClassificationBase):
         # dot with H^T.dot(y)
         if self.verbose:
             print("dot with H^T at time: {}".format(time.asctime(time.localtime(time.time()))))
-        self.W = self.X.T.dot(inverted_piece).dot(self.Y)
+        self.set_weights(self.X.T.dot(inverted_piece).dot(self.Y))
         if self.verbose:
             print("done dotting with H^T at time: {}".format(time.asctime(time.localtime(time.time()))))
-        assert self.W.shape == (self.d, self.C)
+        return self.W
 
     def predict(self):
         if self.verbose:
@@ -139,12 +425,8 @@ class RidgeMulti(ClassificationBase):
         Yhat = self.apply_weights()
         assert type(Yhat) == np.ndarray
         classes = np.argmax(Yhat, axis=1)
-        if self.sparse:
-            yhat = np.multiply(self.Y.toarray(), Yhat)
-        else:
-            yhat = np.multiply(self.Y, Yhat)
-        # collapse it into an Nx1 array:
-        self.yhat = np.amax(yhat, axis=1)
+        # prediction for each point's true class, as an Nx1 array:
+        self.yhat = Yhat[np.arange(self.N), np.ravel(self.y)]
         return classes
 
     def run(self):
@@ -189,12 +471,11 @@ class RidgeMulti(ClassificationBase):
 
         :return: sum of squared errors for all classes for each point (float)
         """
-        if self.sparse:
-            error = self.apply_weights() - self.Y.toarray()
-            assert type(error) == np.ndarray
-        else:
-            error = self.apply_weights() - self.Y
-        return np.multiply(error, error).sum()
+        # Y is one-hot, so ||Yhat - Y||^2 = ||Yhat||^2 - 2*sum(Yhat[i, y_i]) + N
+        # and we never need a dense copy of Y.
+        Yhat = self.apply_weights()
+        correct_class = Yhat[np.arange(self.N), np.ravel(self.y)]
+        return np.multiply(Yhat, Yhat).sum() - 2*correct_class.sum() + self.N
 
     def rmse(self):
         """
@@ -214,10 +495,14 @@ class RidgeBinary(ClassificationBase):
     """
     Train *one* ridge model.
     """
-    def __init__(self, X, y, lam, w=None, test_X=None, test_y = None):
+    def __init__(self, X, y, lam, w=None, test_X=None, test_y = None,
+                 solver='factorize', verbose=False):
         """
         test_X, test_y are for compatibility only, because the questions for
          other methods require knowing test data during fitting.
+
+        solver: 'factorize' (Cholesky) or 'inverse' (original explicit
+         inverse).
         """
         self.X = X
         self.N, self.d = X.shape
@@ -227,22 +512,51 @@ class RidgeBinary(ClassificationBase):
             self.w = np.zeros(self.d)
         assert self.w.shape == (self.d, )
         self.threshold = None
+        assert solver in ('factorize', 'inverse')
+        self.solver = solver
+        self.verbose = verbose
+        self.yhat = None  # Xw; dropped whenever w or X is assigned
+
+    def __setattr__(self, name, value):
+        """
+        yhat = Xw is cached, so assigning w or X drops it.
+        """
+        if name in ('w', 'X'):
+            self.__dict__['yhat'] = None
+        super(RidgeBinary, self).__setattr__(name, value)
 
     def get_weights(self):
         return self.w
 
     def apply_weights(self):
-        return self.X.dot(self.w)
+        """
+        yhat = Xw, computed once per w and X and shared by predict
+        (for every threshold), loss_01, sse and rmse.
+        """
+        if self.yhat is None:
+            if self.verbose:
+                print("dot X with W to make predictions.  {}".format(time.asctime(time.localtime(time.time()))))
+            yhat = self.X.dot(self.w)
+            if sp.issparse(yhat):
+                yhat = yhat.toarray()
+            self.yhat = np.asarray(yhat)
+            if self.verbose:
+                print("done dotting.  {}".format(time.asctime(time.localtime(time.time()))))
+        return self.yhat
 
     def run(self):
 
         # find lambda*I_D + X^T*X
         piece_to_invert = np.identity(self.d)*self.lam + self.X.T.dot(self.X)
 
-        inverted_piece = np.linalg.inv(piece_to_invert)
+        if self.solver == 'factorize':
+            solution = solve_normal_equations(piece_to_invert,
+                                              self.X.T.dot(self.y))
+        else:
+            inverted_piece = np.linalg.inv(piece_to_invert)
 
-        solution = inverted_piece.dot(self.X.T)
-        solution = solution.dot(self.y)
+            solution = inverted_piece.dot(self.X.T)
+            solution = solution.dot(self.y)
 
         solution = np.squeeze(np.asarray(solution))
         assert solution.shape == (self.d, )
@@ -250,16 +564,19 @@ class RidgeBinary(ClassificationBase):
         self.results = pd.DataFrame(self.results_row())
 
     def predict(self, threshold):
-        if self.verbose:
-            print("dot X with W to make predictions.  {}".format(time.asctime(time.localtime(time.time()))))
         # TODO: having a default cutoff is a terrible idea!
-        Yhat = self.X.dot(self.w)
-        if self.verbose:
-            print("done dotting.  {}".format(time.asctime(time.localtime(time.time()))))
+        Yhat = self.apply_weights()
         classes = np.zeros(self.N)
         classes[Yhat > threshold] = 1
         return classes
 
+    def threshold_sweep(self):
+        """
+        Confusion counts and 0/1 loss for every threshold, from one pass
+        over the (cached) predictions.  See threshold_sweep().
+        """
+        return threshold_sweep(self.apply_weights(), self.y)
+
     def loss_01(self, threshold=None):
         if threshold is None:
             threshold=0.5
@@ -317,9 +634,67 @@ class RidgeRegularizationPath:
         assert rr.w.shape == (self.train_d, 1) # check before we slice out
         return rr.w.toarray()[:,0], sse_train, sse_val
 
-    def walk_path(self):
+    def eigen_path(self, lams):
+        """
+        Weights, training SSE and validation SSE for every lambda in lams,
+        from one eigendecomposition.
+
+        Decompose the smaller of X^T X (d x d) and X X^T (N x N) once.  With
+        X^T X = V diag(e) V^T and c = V^T X^T y, the ridge solution is
+        w = V diag(1/(e + lambda)) c, so each lambda only rescales c.
+        (Likewise with X X^T = U diag(e) U^T, c = U^T y and w = X^T U
+        diag(1/(e + lambda)) c.)
+        """
+        X = self.train_X
+        y = self.train_y
+        y = np.asarray(y.todense()).ravel() if sp.issparse(y) else np.ravel(y)
+        val_y = self.val_y
+        val_y = np.asarray(val_y.todense()).ravel() if sp.issparse(val_y) \
+            else np.ravel(val_y)
+
+        def dense(m):
+            return m.toarray() if sp.issparse(m) else np.asarray(m)
+
+        results = []
+        if self.train_d <= self.train_N:
+            evals, V = np.linalg.eigh(dense(X.T.dot(X)))
+            evals = np.clip(evals, 0, None)  # round-off can make these < 0
+            c = V.T.dot(np.ravel(dense(X.T.dot(y))))
+            y_squared = y.dot(y)
+            val_XV = dense(self.val_X.dot(V))
+            for lam in lams:
+                coefs = c/(evals + lam)
+                w = V.dot(coefs)
+                # ||y - Xw||^2 = y'y - 2 w'X'y + w'X'Xw
+                sse_train = y_squared - 2*c.dot(coefs) + \
+                    (evals*coefs).dot(coefs)
+                error = val_XV.dot(coefs) - val_y
+                results.append((w, sse_train, error.dot(error)))
+        else:
+            evals, U = np.linalg.eigh(dense(X.dot(X.T)))
+            evals = np.clip(evals, 0, None)
+            c = U.T.dot(y)
+            val_XXU = dense(self.val_X.dot(X.T)).dot(U)
+            for lam in lams:
+                coefs = c/(evals + lam)
+                w = np.ravel(dense(X.T.dot(U.dot(coefs))))
+                # Xw = U diag(e) coefs, so y - Xw = U (lam*coefs)
+                sse_train = ((lam*coefs)**2).sum()
+                error = val_XXU.dot(coefs) - val_y
+                results.append((w, sse_train, error.dot(error)))
+        return results
+
+    def walk_path(self, method='eigen'):
+        """
+        :param method: 'eigen' decomposes X once for the whole path;
+            'refit' solves a new Ridge for every lambda.
+        """
         # protect the first value of lambda.
         lam = self.lam_max/self.frac_decrease
+        lams = [self.lam_max*self.frac_decrease**c
+                for c in range(0, self.steps)]
+        if method == 'eigen':
+            path = self.eigen_path(lams)
 
         # initialize a dataframe to store results in
         results = pd.DataFrame()
@@ -327,7 +702,10 @@ class RidgeRegularizationPath:
             lam = lam*self.frac_decrease
             print("Loop {}: solving weights.  Lambda = {}".format(c+1, lam))
 
-            w, sse_train, sse_val = self.train_with_lam(lam)
+            if method == 'eigen':
+                w, sse_train, sse_val = path[c]
+            else:
+                w, sse_train, sse_val = self.train_with_lam(lam)
 
             one_val = pd.DataFrame({"lam":[lam],
                                     "weights":[w],
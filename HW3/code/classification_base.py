@@ -285,6 +285,49 @@ class ClassificationBase:
 
 
 
+class MinibatchIterator(object):
+    """
+    Minibatches for SGD: each epoch is one pass over X and Y in a new
+    random order.
+
+    Only the row indices are shuffled.  Each batch is gathered (np.take)
+    into the same preallocated batch_size-row buffers, so an epoch moves
+    one dataset's worth of memory instead of copying and shuffling all of
+    X and Y first.  The yielded arrays are overwritten by the next batch;
+    copy them if you need to keep them.
+    """
+    def __init__(self, X, Y, batch_size):
+        assert X.shape[0] == Y.shape[0]
+        self.X = X
+        self.Y = Y
+        self.N = X.shape[0]
+        self.batch_size = min(batch_size, self.N)
+        self.X_buffer = self.make_buffer(X)
+        self.Y_buffer = self.make_buffer(Y)
+
+    def make_buffer(self, A):
+        if sp.issparse(A):
+            return None  # sparse rows are gathered with fancy indexing.
+        return np.empty((self.batch_size, ) + A.shape[1:], dtype=A.dtype)
+
+    @staticmethod
+    def gather(A, indices, buffer):
+        if buffer is None:
+            return A[indices]
+        return np.take(A, indices, axis=0, out=buffer[:len(indices)])
+
+    def __iter__(self):
+        order = np.random.permutation(self.N)
+        for start in range(0, self.N, self.batch_size):
+            indices = order[start:start + self.batch_size]
+            yield (self.gather(self.X, indices, self.X_buffer),
+                   self.gather(self.Y, indices, self.Y_buffer))
+
+    def __len__(self):
+        # number of batches per epoch
+        return int(np.ceil(self.N/self.batch_size))
+
+
 class ModelFitException(Exception):
     def __init__(self, message):
         #self.message = message
@@ -1,19 +1,73 @@
 import numpy as np
+import tempfile
 from scipy.spatial.distance import pdist
 
+
+def fwht(A):
+    """
+    In-place, unnormalized Walsh-Hadamard transform along the last axis
+    of the C-contiguous array A, whose length must be a power of 2.
+    O(D log D) butterflies per row instead of a D x D matrix product.
+    """
+    D = A.shape[-1]
+    rows = A.reshape(-1, D)  # a view, so A is updated
+    h = 1
+    while h < D:
+        # pair up entries j and j + h within each block of 2h
+        pairs = rows.reshape(rows.shape[0], D//(2*h), 2, h)
+        top = pairs[:, :, 0, :].copy()
+        bottom = pairs[:, :, 1, :]
+        pairs[:, :, 0, :] += bottom
+        top -= bottom
+        pairs[:, :, 1, :] = top
+        h *= 2
+    return A
+
 class Fourier:
-    def __init__(self, X, k=60000, sigma=None):
+    """
+    Random features for the RBF kernel with bandwidth sigma, for
+    w ~ N(0, I/sigma^2):
+    features='sin' (the default, as before): sin(w.x), float64;
+    'cos': cos(w.x + b), b ~ U[0, 2 pi], the proper random Fourier
+    features; 'cos sin': the paired [cos(w.x), sin(w.x)] for k/2
+    frequencies.  dtype=np.float32 halves the projection's memory.
+
+    The projection is generated from `seed` in column blocks, straight
+    into `dtype` storage, so there's never a full float64 temporary, and
+    it can be regenerated instead of pickled.
+    """
+    # generated from the seed, so not pickled
+    generated_attributes = ('vectors', 'phases')
+
+    def __init__(self, X, k=60000, sigma=None, features='sin',
+                 orthogonal=False, dtype=np.float64, seed=None,
+                 block_size=4096, reuse_output=False):
         self.X = X
         self.k = k
         self.N = X.shape[0]
         self.d = k
+        assert features in ('sin', 'cos', 'cos sin')
+        if features == 'cos sin':
+            assert k%2 == 0, "cos/sin pairs need an even k"
+        self.features = features
+        self.orthogonal = orthogonal
+        self.dtype = np.dtype(dtype)
+        if seed is None:
+            # draw one, so the projection can always be regenerated.
+            seed = np.random.randint(2**31 - 1)
+        self.seed = seed
+        self.block_size = block_size  # projection columns per RNG call
+        # opt in to transform() returning one reused output array
+        self.reuse_output = reuse_output
+        self.buffer = None
+        self.projection_buffer = None
+        self.name = 'random Fourier features'
         if sigma is None:
             sample_size = min(self.N, max(1000, int(X.shape[0]/10)))
             self.set_sigma(sample_size)
         else:
             self.sigma = sigma
         self.generate_feature_vectors()
-        pass
 
     def set_sigma(self, sample_size):
         # About 2000 is good.
@@ -30,28 +84,212 @@ class Fourier:
             sample_size, median_dist))
         self.sigma = median_dist
 
+    def num_frequencies(self):
+        return self.k//2 if self.features == 'cos sin' else self.k
+
     def generate_feature_vectors(self):
         """
-        independently sample every coordinate for every vector from a
-        standard normal distribution (with unit variance).
+        Sample the (n x frequencies) projection, already divided by sigma,
+        and the phases.  Independent standard normal coordinates, or with
+        orthogonal=True, orthogonal random features: blocks of n
+        orthonormal directions, each rescaled to the length of a Gaussian
+        vector.  Same seed, same projection.
         """
         n = self.X.shape[1]
-        self.vectors = np.random.randn(n, self.k)
+        f = self.num_frequencies()
+        rng = np.random.RandomState(self.seed)
+        self.vectors = np.empty((n, f), dtype=self.dtype)
+        block_size = n if self.orthogonal else self.block_size
+        for start in range(0, f, block_size):
+            stop = min(start + block_size, f)
+            block = rng.standard_normal((n, stop - start))
+            if self.orthogonal:
+                Q, _ = np.linalg.qr(rng.standard_normal((n, n)))
+                lengths = np.sqrt(np.square(block).sum(axis=0))
+                block = Q[:, :stop - start]*lengths
+            block /= self.sigma
+            self.vectors[:, start:stop] = block
+        if self.features == 'cos':
+            self.phases = rng.uniform(0, 2*np.pi, size=f).astype(self.dtype)
+        else:
+            self.phases = None
 
-    def transform(self, X):
-        #dot_prod = X.dot(self.vectors)
-        #return np.exp(dot_prod/self.sigma)
-        return np.sin(np.dot(X, self.vectors)/self.sigma)
+    @staticmethod
+    def reuse(buffer, shape, dtype):
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            return np.empty(shape, dtype=dtype)
+        return buffer
+
+    def project(self, X, out):
+        """
+        Fill out (n x frequencies) with the projections w.x.
+        """
+        return np.dot(X, self.vectors, out=out)
+
+    def transform(self, X, out=None):
+        """
+        Transforms a matrix, which isn't necessarily self.X
+
+        :param out: (n x k) array to write into.  If None, a new array,
+            unless the kernel was made with reuse_output=True: then a
+            buffer kept on the kernel is returned, and overwritten by the
+            next call with the same number of rows.
+        """
+        n = X.shape[0]
+        X = np.asarray(X, dtype=self.dtype)
+        if out is None and self.reuse_output:
+            self.buffer = self.reuse(self.buffer, (n, self.d), self.dtype)
+            out = self.buffer
+        elif out is None:
+            out = np.empty((n, self.d), dtype=self.dtype)
+        assert out.shape == (n, self.d), "out has shape {}".format(out.shape)
+
+        if self.features != 'cos sin' and out.dtype == self.dtype:
+            self.project(X, out)
+            if self.features == 'sin':
+                return np.sin(out, out=out)
+            out += self.phases
+            return np.cos(out, out=out)
+
+        f = self.num_frequencies()
+        self.projection_buffer = self.reuse(self.projection_buffer, (n, f),
+                                            self.dtype)
+        projection = self.project(X, self.projection_buffer)
+        if self.features == 'sin':
+            return np.sin(projection, out=out)
+        if self.features == 'cos':
+            projection += self.phases
+            return np.cos(projection, out=out)
+        np.cos(projection, out=out[:, :f])
+        np.sin(projection, out=out[:, f:])
+        return out
+
+    def __getstate__(self):
+        # The projection is regenerated from the seed on unpickling.
+        state = self.__dict__.copy()
+        for name in self.generated_attributes + ('buffer',
+                                                 'projection_buffer'):
+            state[name] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.generate_feature_vectors()
+
+    def info(self):
+        return {'kernel':[self.name], 'k':[self.k], 'sigma':[self.sigma],
+                'Fourier features':[self.features],
+                'orthogonal':[self.orthogonal], 'dtype':[self.dtype.name]}
+
+
+class Fastfood(Fourier):
+    """
+    Random Fourier features with the dense Gaussian projection replaced by
+    Fastfood blocks, (1/(sigma sqrt(D))) S H G P H B, for H the D x D
+    Walsh-Hadamard matrix (D = input dimension padded to a power of 2),
+    B random signs, P a random permutation, G Gaussian, and S rescaling
+    each row to the length of a Gaussian vector.
+
+    Only the diagonals and permutations are stored, O(k) memory, and
+    projecting a point costs O(k log D) instead of O(k d).  Plugs into
+    LeastSquaresSGD the same way: kernel=Fastfood.
+    """
+    generated_attributes = ('B', 'G', 'S', 'permutations', 'phases')
+
+    def __init__(self, X, k=60000, sigma=None, features='cos',
+                 dtype=np.float32, seed=None, reuse_output=False):
+        self.D = 2**int(np.ceil(np.log2(X.shape[1])))
+        self.fastfood_buffer = None
+        self.permuted_buffer = None
+        super(Fastfood, self).__init__(X, k=k, sigma=sigma,
+                                       features=features, dtype=dtype,
+                                       seed=seed, reuse_output=reuse_output)
+        self.name = 'Fastfood'
+
+    def num_blocks(self):
+        return int(np.ceil(self.num_frequencies()/self.D))
+
+    def generate_feature_vectors(self):
+        """
+        Sample each block's diagonals and permutation from the seed.  The
+        1/(sigma sqrt(D)) and the 1/||G|| normalization are folded into S.
+        """
+        D, blocks = self.D, self.num_blocks()
+        rng = np.random.RandomState(self.seed)
+        self.B = rng.choice([-1., 1.], size=(blocks, D)).astype(self.dtype)
+        # each block's permutation, as indices into the flattened blocks
+        self.permutations = np.concatenate(
+            [rng.permutation(D) + b*D for b in range(blocks)])
+        G = rng.standard_normal((blocks, D))
+        # each row of H G P H B has length sqrt(D)*||G||
+        row_lengths = np.sqrt(rng.chisquare(D, size=(blocks, D)))
+        G_norms = np.sqrt(np.square(G).sum(axis=1))[:, np.newaxis]
+        self.S = (row_lengths/G_norms/(self.sigma*np.sqrt(D))
+                  ).astype(self.dtype)
+        self.G = G.astype(self.dtype)
+        f = self.num_frequencies()
+        if self.features == 'cos':
+            self.phases = rng.uniform(0, 2*np.pi, size=f).astype(self.dtype)
+        else:
+            self.phases = None
 
     def info(self):
-        return {'sigma':[self.sigma]}
+        info = super(Fastfood, self).info()
+        info['D'] = [self.D]
+        info['Fastfood blocks'] = [self.num_blocks()]
+        return info
+
+    def __getstate__(self):
+        state = super(Fastfood, self).__getstate__()
+        state['fastfood_buffer'] = None
+        state['permuted_buffer'] = None
+        return state
+
+    def project(self, X, out):
+        """
+        Fill out (n x frequencies) with S H G P H B x, every block at once.
+        """
+        n, p = X.shape
+        blocks = self.num_blocks()
+        shape = (n, blocks, self.D)
+        Z = self.reuse(self.fastfood_buffer, shape, self.dtype)
+        self.fastfood_buffer = Z
+        # B x, zero-padded up to D
+        np.multiply(X[:, np.newaxis, :], self.B[:, :p], out=Z[:, :, :p])
+        Z[:, :, p:] = 0
+        fwht(Z)
+        # P, gathered into the second buffer
+        permuted = self.reuse(self.permuted_buffer, shape, self.dtype)
+        self.permuted_buffer = permuted
+        np.take(Z.reshape(n, blocks*self.D), self.permutations, axis=1,
+                out=permuted.reshape(n, blocks*self.D))
+        Z = permuted
+        Z *= self.G
+        fwht(Z)
+        Z *= self.S
+        out[:] = Z.reshape(n, blocks*self.D)[:, :out.shape[1]]
+        return out
 
 
 class RBFKernel:
-    def __init__(self, X, sigma=None):
+    """
+    Maps x to [k(x, x_1), ..., k(x, x_N)] for k the RBF kernel, or, given
+    n_landmarks = m, to the m-dimensional Nystrom features
+    k(x, landmarks) K_mm^(-1/2), whose dot products approximate k.
+    """
+    def __init__(self, X, sigma=None, block_size=1000,
+                 n_landmarks=None, landmark_method='uniform',
+                 kmeans_pool_size=None, reuse_output=False):
         self.X = X
         self.N = X.shape[0]
         self.d = X.shape[0] # N by d --> N by N
+        # ||x_j||^2 for the training rows; reused by every transform.
+        self.X_sq_norms = np.einsum('ij,ij->i', X, X)
+        self.block_size = block_size  # query rows per GEMM in transform
+        # opt in to transform() returning one reused output array
+        self.reuse_output = reuse_output
+        self.buffer = None
+        self.nystrom_buffer = None
         if sigma is None:
             sample_size = min(self.N, max(1000, int(X.shape[0]/10)))
             self.set_sigma(sample_size)
@@ -59,6 +297,12 @@ class RBFKernel:
             self.sigma = sigma
         self.name = 'radial basis function'
 
+        self.n_landmarks = n_landmarks
+        self.landmark_method = landmark_method
+        if n_landmarks is not None:
+            self.name = 'radial basis function (Nystrom)'
+            self.set_landmarks(n_landmarks, landmark_method, kmeans_pool_size)
+
     def set_sigma(self, sample_size):
         """
         setting σ is often done with the ’median trick’, which is the median
@@ -87,6 +331,65 @@ class RBFKernel:
             sample_size, median_dist))
         self.sigma = median_dist
 
+    def set_landmarks(self, m, method='uniform', pool_size=None):
+        """
+        Pick m landmark rows of X and the K_mm^(-1/2) that whitens their
+        kernel features.  The feature space becomes m-dimensional.
+
+        :param method: 'uniform' (random rows) or 'kmeans++' (D^2
+            sampling, which spreads the landmarks over the data).
+        :param pool_size: k-means++ candidates, drawn uniformly from X.
+            Defaults to min(N, 10m), to bound its O(pool * m * d) cost.
+        """
+        assert m <= self.N, "can't pick more landmarks than points"
+        print('choose {} Nystrom landmarks ({}).'.format(m, method))
+        if method == 'uniform':
+            rows = np.random.choice(self.N, m, replace=False)
+        elif method == 'kmeans++':
+            if pool_size is None:
+                pool_size = min(self.N, 10*m)
+            pool = np.random.choice(self.N, pool_size, replace=False)
+            rows = pool[self.kmeans_plus_plus(pool, m)]
+        else:
+            assert False, "unknown landmark method {}".format(method)
+        self.landmarks = self.X[np.sort(rows)]
+        self.landmark_sq_norms = \
+            np.einsum('ij,ij->i', self.landmarks, self.landmarks)
+        self.d = m
+
+        # K_mm = U diag(s) U^T;  K_mm^(-1/2) = U diag(s^(-1/2)) U^T.
+        # Near-zero eigenvalues (duplicate landmarks) are dropped.
+        K_mm = self.rbf(self.landmarks, self.landmarks,
+                        self.landmark_sq_norms, out=np.empty((m, m)))
+        s, U = np.linalg.eigh(K_mm)
+        keep = s > s.max()*1e-10
+        U = U[:, keep]
+        self.normalization = (U/np.sqrt(s[keep])).dot(U.T)
+
+    def kmeans_plus_plus(self, pool, m):
+        """
+        k-means++ seeding on the rows X[pool]: each new landmark is drawn
+        with probability proportional to its squared distance from the
+        nearest landmark picked so far.
+        :return: positions in pool of the m landmarks.
+        """
+        P = self.X[pool]
+        P_sq_norms = self.X_sq_norms[pool]
+        chosen = [np.random.randint(len(pool))]
+        min_sq_dist = np.full(len(pool), np.inf)
+        for _ in range(1, m):
+            c = chosen[-1]
+            sq_dist = P_sq_norms + P_sq_norms[c] - 2.*P.dot(P[c])
+            np.minimum(min_sq_dist, np.maximum(sq_dist, 0.), out=min_sq_dist)
+            total = min_sq_dist.sum()
+            if total == 0:
+                # every candidate is already a landmark's duplicate.
+                remaining = np.setdiff1d(np.arange(len(pool)), chosen)
+                chosen.append(np.random.choice(remaining))
+                continue
+            chosen.append(np.random.choice(len(pool), p=min_sq_dist/total))
+        return np.array(chosen)
+
     def transform_vector(self, xi):
         """
         transforms a single point
@@ -95,15 +398,76 @@ class RBFKernel:
         dist_squared = np.multiply(dist, dist)
         return np.exp(dist_squared/(-2.)/self.sigma**2)
 
-    def transform(self, X):
+    def rbf(self, X, Z, Z_sq_norms, out):
+        """
+        Fill out (n x m) with k(x_i, z_j).
+
+        Uses ||x - z||^2 = ||x||^2 + ||z||^2 - 2 x.z, so each block of
+        block_size rows of X is one matrix product against Z, written
+        straight into the output.
+        """
+        n = X.shape[0]
+        X_sq_norms = np.einsum('ij,ij->i', X, X)
+        scale = -1./(2.*self.sigma**2)
+        for start in range(0, n, self.block_size):
+            stop = min(start + self.block_size, n)
+            block = out[start:stop]
+            if block.dtype == np.result_type(X, Z):
+                np.dot(X[start:stop], Z.T, out=block)
+            else:
+                block[:] = np.dot(X[start:stop], Z.T)
+            block *= -2.
+            block += X_sq_norms[start:stop, np.newaxis]
+            block += Z_sq_norms
+            # round-off can leave tiny negative squared distances.
+            np.maximum(block, 0., out=block)
+            block *= scale
+            np.exp(block, out=block)
+        return out
+
+    @staticmethod
+    def reuse(buffer, shape, dtype):
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            return np.empty(shape, dtype=dtype)
+        return buffer
+
+    def transform(self, X, out=None):
         """
         Transforms a matrix, which isn't necessarily self.X
+
+        :param out: (n x d) array to write into.  If None, a new array,
+            unless the kernel was made with reuse_output=True: then a
+            buffer kept on the kernel is returned, and overwritten by the
+            next call with the same number of rows.
         """
-        # TODO: could apply only to the first 1/2 of point (I think)
-        return np.apply_along_axis(func1d=self.transform_vector, axis=1, arr=X)
+        n = X.shape[0]
+        dtype = np.result_type(X, self.X, float)
+        if out is None and self.reuse_output:
+            self.buffer = self.reuse(self.buffer, (n, self.d), dtype)
+            out = self.buffer
+        elif out is None:
+            out = np.empty((n, self.d), dtype=dtype)
+        assert out.shape == (n, self.d), "out has shape {}".format(out.shape)
+
+        if self.n_landmarks is None:
+            return self.rbf(X, self.X, self.X_sq_norms, out)
+
+        # Nystrom: k(x, landmarks) K_mm^(-1/2)
+        self.nystrom_buffer = self.reuse(self.nystrom_buffer, (n, self.d),
+                                         dtype)
+        K_nm = self.rbf(X, self.landmarks, self.landmark_sq_norms,
+                        self.nystrom_buffer)
+        if out.dtype == np.result_type(K_nm, self.normalization):
+            return np.dot(K_nm, self.normalization, out=out)
+        out[:] = K_nm.dot(self.normalization)
+        return out
 
     def info(self):
-        return {'sigma':[self.sigma]}
+        info = {'sigma':[self.sigma]}
+        if self.n_landmarks is not None:
+            info['Nystrom landmarks'] = [self.n_landmarks]
+            info['landmark method'] = [self.landmark_method]
+        return info
 
 
 class NoKernel:
@@ -117,3 +481,57 @@ class NoKernel:
 
     def info(self):
         return {"null kernel":[None]}
+
+
+def kernel_key(kernel):
+    """
+    What determines a kernel's feature map: its class, its d, its info()
+    (sigma, landmarks, feature type, ...) and its seed if it has one.
+    """
+    info = sorted((k, repr(v)) for k, v in kernel.info().items())
+    return (type(kernel).__name__, kernel.d, tuple(info),
+            getattr(kernel, 'seed', None))
+
+
+class FeatureCache:
+    """
+    The kernel map of one dataset, computed once.
+
+    Held in memory, in the kernel's own dtype (or `dtype`, if given), when
+    it fits in max_bytes.  Otherwise it goes to a memory-mapped temporary
+    file in `directory` (local disk), downcast to `disk_dtype` (float32)
+    to halve the I/O; the file is deleted when the cache goes away.
+    """
+    def __init__(self, kernel, X, max_bytes=2*1024**3, directory=None,
+                 chunk_size=1000, dtype=None, disk_dtype=np.float32):
+        self.key = kernel_key(kernel)
+        self.X = X  # keeps id(X) from being reused while cached
+        shape = (X.shape[0], kernel.d)
+        first = kernel.transform(X[:chunk_size])
+        if dtype is None:
+            dtype = first.dtype
+        nbytes = shape[0]*shape[1]*np.dtype(dtype).itemsize
+        self.file = None
+        if nbytes <= max_bytes:
+            self.features = np.empty(shape, dtype=dtype)
+        else:
+            nbytes = shape[0]*shape[1]*np.dtype(disk_dtype).itemsize
+            print('caching {:.1f} GB of kernel features on disk ({}).'.format(
+                nbytes/1024.**3, np.dtype(disk_dtype).name))
+            self.file = tempfile.TemporaryFile(dir=directory)
+            self.features = np.memmap(self.file, dtype=disk_dtype, mode='w+',
+                                      shape=shape)
+        self.features[:first.shape[0]] = first
+        for start in range(first.shape[0], shape[0], chunk_size):
+            stop = min(start + chunk_size, shape[0])
+            self.features[start:stop] = kernel.transform(X[start:stop])
+
+    def matches(self, kernel, X):
+        return self.X is X and self.key == kernel_key(kernel)
+
+    def chunks(self, chunk_size):
+        """
+        Yield the cached features in row blocks.
+        """
+        for start in range(0, self.features.shape[0], chunk_size):
+            yield self.features[start:start + chunk_size]
@@ -10,7 +10,9 @@ import matplotlib.pyplot as plt
 
 from classification_base import ClassificationBase
 from classification_base import ModelFitException
-from kernel import RBFKernel, Fourier
+from classification_base import MinibatchIterator
+from kernel import RBFKernel, Fourier, FeatureCache
+from optimizers import SGD
 
 
 class LeastSquaresSGD(ClassificationBase):
@@ -21,6 +23,8 @@ class LeastSquaresSGD(ClassificationBase):
     def __init__(self, X, y, eta0=None, W=None,
                  kernel=Fourier,
                  kernel_kwargs=None,
+                 optimizer=SGD,
+                 optimizer_kwargs=None,
                  eta0_search_start=10,  # gets normalized by N
                  eta0_max_pts=None,
                  max_epochs=50,  # of times passing through N pts
@@ -28,7 +32,10 @@ class LeastSquaresSGD(ClassificationBase):
                  delta_percent=0.01, verbose=False,
                  check_W_bar_fit_during_fitting=False,
                  test_X=None, test_y=None,
-                 assess_test_data_during_fitting=False):
+                 assess_test_data_during_fitting=False,
+                 cache_features=False,
+                 feature_cache_max_bytes=2*1024**3,
+                 feature_cache_dir=None):
 
         # check data
         assert X.shape[0] == y.shape[0]
@@ -56,6 +63,21 @@ class LeastSquaresSGD(ClassificationBase):
         # write over base class's W
         self.W = np.zeros(shape=(self.kernel.d, self.C))
 
+        # Optionally compute each dataset's kernel map once per fit, and
+        # reuse it every epoch and every time the fit is observed.  Caches
+        # that fit in feature_cache_max_bytes keep the kernel's dtype; ones
+        # spilled to disk are stored as float32.
+        self.cache_features = cache_features
+        self.feature_cache_max_bytes = feature_cache_max_bytes
+        self.feature_cache_dir = feature_cache_dir
+        self.feature_caches = []
+
+        # set up the update rule (plain SGD, momentum, AdaGrad, Adam, ...)
+        if optimizer_kwargs is not None:
+            self.optimizer = optimizer(**optimizer_kwargs)
+        else:
+            self.optimizer = optimizer()
+
         # set up attributes used for fitting
         self.epochs = 0
         self.max_epochs = max_epochs
@@ -78,7 +100,10 @@ class LeastSquaresSGD(ClassificationBase):
         self.check_W_bar_fit_during_fitting = check_W_bar_fit_during_fitting
 
         self.eta0_search_start = eta0_search_start
-        if eta0 is None:
+        if eta0 is None and self.optimizer.adaptive:
+            # adaptive optimizers take a raw, scale-free eta0; no search.
+            self.eta0 = self.optimizer.default_eta0
+        elif eta0 is None:
             self.eta0_search_calls = 0
             if eta0_max_pts is None:
                 eta0_max_pts=3000
@@ -113,6 +138,9 @@ class LeastSquaresSGD(ClassificationBase):
             self.eta = self.eta0
         self.eta0_search_calls = 0
         self.zero_weights()
+        self.feature_caches = []
+        # don't share the optimizer's state with the model copied from
+        self.optimizer = self.optimizer.fresh()
         self.results = None
 
     def find_good_learning_rate(self,max_pts=5000):
@@ -226,11 +254,27 @@ class LeastSquaresSGD(ClassificationBase):
         assert gradient.shape == (self.kernel.d, self.C)
 
         assert self.eta is not None
-        self.W += -(self.eta/n)*gradient
+        self.optimizer.update(self.W, gradient, lr=self.learning_rate(n))
         assert self.W.shape == (self.kernel.d ,self.C), \
             "shape of W is {}".format(self.W.shape)
         self.steps += 1
 
+    def cached_features(self, X):
+        """
+        The FeatureCache holding X's kernel map (built on first use), or
+        None if feature caching is off.
+        """
+        if not self.cache_features:
+            return None
+        for cache in self.feature_caches:
+            if cache.matches(self.kernel, X):
+                return cache
+        cache = FeatureCache(self.kernel, X,
+                             max_bytes=self.feature_cache_max_bytes,
+                             directory=self.feature_cache_dir)
+        self.feature_caches.append(cache)
+        return cache
+
     def calc_Yhat(self, chunk_size=10, calc_for_W_bar = True):
         """
         Produce an (NxC) array of classes predictions on X, which has *not*
@@ -251,34 +295,34 @@ class LeastSquaresSGD(ClassificationBase):
 
         def build_up_Yhat(X_chunk, Yhat, weights):
             assert weights is not None
-            Yhat_chunk = X_chunk.dot(weights)
+            Yhat_chunk = Yhat[n: n+X_chunk.shape[0]]
+            Yhat_chunk[:] = X_chunk.dot(weights)
             assert not np.isnan(Yhat_chunk).any()
-            assert Yhat_chunk.shape == (X_chunk.shape[0], self.C)
-            if Yhat is None:
-                Yhat = Yhat_chunk
-            else:
-                Yhat = np.vstack([Yhat, Yhat_chunk])
-            return Yhat
 
-        Yhat = None
-        Yhat_Wbar = None
+        Yhat = np.empty((N, self.C))
+        Yhat_Wbar = np.empty((N, self.C)) if calc_for_W_bar else None
+
+        cache = self.cached_features(X)
+        if cache is not None:
+            # already transformed, so read it in big blocks.
+            kernel_chunks = cache.chunks(max(chunk_size, 1000))
+        else:
+            kernel_chunks = (self.kernel.transform(X[i: i+chunk_size, ])
+                             for i in range(0, N, chunk_size))
 
-        # for each chunk of X, transform to kernel and find Yhat.
+        # for each chunk of X's kernel map, find Yhat.
         num_iter = 0
-        while n < N:
-            # Find kernel-version of a chunk of X
-            X_chunk = X[n: n+chunk_size, ]
-            kernel_chunk = self.kernel.transform(X_chunk)
-            assert kernel_chunk.shape == (X_chunk.shape[0], self.kernel.d)
+        for kernel_chunk in kernel_chunks:
+            assert kernel_chunk.shape[1] == self.kernel.d
 
             assert not np.isnan(self.W).any()
 
-            Yhat = build_up_Yhat(X_chunk=kernel_chunk, Yhat=Yhat, weights=self.W)
+            build_up_Yhat(X_chunk=kernel_chunk, Yhat=Yhat, weights=self.W)
             if calc_for_W_bar:
-                Yhat_Wbar = build_up_Yhat(X_chunk=kernel_chunk, Yhat=Yhat_Wbar,
-                                          weights=Wbar)
+                build_up_Yhat(X_chunk=kernel_chunk, Yhat=Yhat_Wbar,
+                              weights=Wbar)
 
-            n += X_chunk.shape[0]
+            n += kernel_chunk.shape[0]
 
             num_iter += 1
             if num_iter%100 == 0:
@@ -322,14 +366,25 @@ class LeastSquaresSGD(ClassificationBase):
         assert not math.isnan(squares_sum)
         return squares_sum
 
+    def learning_rate(self, n):
+        """
+        The step size handed to the optimizer for a batch of n points:
+        eta/n for SGD and momentum, the raw eta0 for adaptive ones.
+        """
+        if self.optimizer.adaptive:
+            return self.eta0
+        return self.eta/n
+
     def shrink_eta(self, s_exp=0.5):
         """
         Scale eta by the number of steps, in a way that is independent of
-        the batch size.
+        the batch size.  Adaptive optimizers shrink their own steps.
         :param s: steps so far
         :param s_exp: exponential rate
         :return:
         """
+        if self.optimizer.adaptive:
+            return
         epochs = (self.steps - self.fast_steps)/(self.N) + 1
         self.eta = self.eta0/(epochs**s_exp)
 
@@ -368,6 +423,7 @@ class LeastSquaresSGD(ClassificationBase):
         row.update(more_details)
         kernel_info = self.kernel.info()
         row.update(kernel_info)
+        row.update(self.optimizer.info())
         self.Yhat = None  # wipe it so it can't be used incorrectly later
         self.Yhat_Wbar = None  # wipe it so it can't be used incorrectly later
         return row
@@ -410,6 +466,15 @@ class LeastSquaresSGD(ClassificationBase):
         old_square_loss_norm = \
                 self.results.tail(1).reset_index()['(square loss)/N, training'][0]
 
+        # Reshuffled every epoch, without copying X and Y.  Batches come
+        # straight from the kernel map if it's cached.
+        cache = self.cached_features(self.X)
+        if cache is not None:
+            minibatches = MinibatchIterator(cache.features, self.Y,
+                                            self.batch_size)
+        else:
+            minibatches = MinibatchIterator(self.X, self.Y, self.batch_size)
+
         # Step until converged
         while self.epochs < self.max_epochs:
             if self.converged:
@@ -423,23 +488,18 @@ class LeastSquaresSGD(ClassificationBase):
 
             if self.verbose:
                 print('Begin epoch {}'.format(self.epochs))
-            # Shuffle each time we loop through the entire data set.
-            X, Y = self.shuffle(self.X.copy(), self.Y.copy())
-
-            # loop over ~all of the data points in little batches.
+            # loop over all of the data points in little batches, in a
+            # new order each epoch.
             num_pts = 0
             iter = 0
             epoch_iters = 0
-            while num_pts < self.N :
+            for X_sample, Y_sample in minibatches:
 
                 iter += 1
 
-                idx_start = num_pts
-                idx_stop = num_pts + self.batch_size
-                X_sample = X[idx_start:idx_stop, ] # works even if you ask for too many rows.
                 # apply the kernel transformation
-                X_sample = self.kernel.transform(X_sample)
-                Y_sample = Y[idx_start:idx_stop, ]
+                if cache is None:
+                    X_sample = self.kernel.transform(X_sample)
 
                 # update W
                 self.step(X_sample, Y_sample)
@@ -1,3 +1,4 @@
+import datetime
 import numpy as np
 import sys
 import pandas as pd
@@ -5,7 +6,9 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 from classification_base import ClassificationBase
-from classification_base import ModelFitExcpetion
+from classification_base import ModelFitException
+from classification_base import MinibatchIterator
+from optimizers import SGD
 
 
 class LogisticRegression(ClassificationBase):
@@ -18,7 +21,11 @@ class LogisticRegression(ClassificationBase):
                  batch_size = 100,
                  progress_monitoring_freq=15000,
                  delta_percent=1e-3, verbose=False,
-                 test_X=None, test_y=None): #
+                 test_X=None, test_y=None,
+                 monitor_sample_size=None, # rows used to estimate the loss
+                 full_eval_every=1, # full train/test evaluation schedule
+                 loss_ema_decay=0.9,
+                 optimizer=SGD, optimizer_kwargs=None): #
         # call the base class's methods first
         super(LogisticRegression, self).__init__(X=X, y=y, W=W)
         self.eta0 = eta0
@@ -39,6 +46,54 @@ class LogisticRegression(ClassificationBase):
         self.progress_monitoring_freq = progress_monitoring_freq
         self.num_passes_through_N_pts = 0
         self.points_sampled = 0
+        # wall-clock seconds spent stepping; excludes monitoring.
+        self.training_seconds = 0.
+        self.buffers = {}  # n --> reused n x C work space for the softmax
+
+        # update rule: plain SGD, momentum, AdaGrad, Adam, ...
+        if optimizer_kwargs is not None:
+            self.optimizer = optimizer(**optimizer_kwargs)
+        else:
+            self.optimizer = optimizer()
+
+        # Monitoring.  Convergence is judged on a fixed random subsample of
+        # the training rows (all rows if monitor_sample_size is None), and
+        # the full train + test evaluation only runs on every
+        # full_eval_every-th progress check.  The rest record cheap rows.
+        assert full_eval_every >= 1
+        self.full_eval_every = full_eval_every
+        self.monitoring_checks = 0
+        self.loss_ema_decay = loss_ema_decay
+        self.minibatch_loss_ema = None  # EMA of minibatch -(log loss)/n
+        self.set_monitoring_sample(monitor_sample_size)
+
+    def set_monitoring_sample(self, size):
+        """
+        Fix the training rows used to estimate the loss during fitting.
+        With no size (or one >= N), all of the current X is used.
+        """
+        self.monitor_sample_size = size
+        self.monitor_sample = None
+        if size is None or size >= self.N:
+            return
+        rows = np.sort(np.random.choice(self.N, size=size, replace=False))
+        self.monitor_sample = (self.X[rows], self.Y[rows], self.y[rows])
+
+    def monitoring_data(self):
+        """
+        (X, Y, y) to estimate the loss on: the fixed subsample, or else
+        whatever the training data is right now.
+        """
+        if self.monitor_sample is None:
+            return self.X, self.Y, self.y
+        return self.monitor_sample
+
+    def replace_X_and_y(self, X, y):
+        super(LogisticRegression, self).replace_X_and_y(X, y)
+        # draw the monitoring rows from the new data
+        self.set_monitoring_sample(self.monitor_sample_size)
+        # new row counts; and a copy (apply_model) gets its own buffers
+        self.buffers = {}
 
     def apply_weights(self, X):
         """
@@ -48,42 +103,72 @@ class LogisticRegression(ClassificationBase):
         """
         return X.dot(self.get_weights())
 
-    def probability_array(self, X):
+    def score_buffer(self, n):
+        """
+        An n x C array to work the softmax out in, one per row count, so
+        minibatches, the monitoring sample and full-data evaluations each
+        keep their own instead of reallocating in turn.
+        """
+        if n not in self.buffers:
+            self.buffers[n] = np.empty((n, self.C))
+        return self.buffers[n]
+
+    def shifted_scores(self, X, out):
+        """
+        Fill out with XW minus each row's max.  Softmax doesn't change when
+        a row is shifted, and afterwards the largest exponent is exp(0), so
+        big weights (large learning rates) can't overflow to inf/NaN.
+        """
+        W = self.get_weights()
+        if isinstance(X, np.ndarray) and out.dtype == np.result_type(X, W):
+            np.dot(X, W, out=out)
+        else:
+            out[:] = self.apply_weights(X)
+        out -= out.max(axis=1)[:, np.newaxis]
+        return out
+
+    def probability_array(self, X, out=None):
         """
         Calculate the array of probabilities.
-        :return: An Nx1 array.
+        :param out: n x C array to write them into.  A new one if None.
+        :return: An nxC array.
         """
         n = X.shape[0]
-        R = np.exp(self.apply_weights(X))
-        if R.shape[0] != n:
-            print("R has shape {}".format(R.shape))
-        assert R.shape[0] == n, "X dot W has dim {}".format(R.shape)
-        # When you sum across a row, axis=1
-        R_sum_ax1 = np.sum(R, axis=1)
-        R_sum_ax1 = np.reshape(R_sum_ax1, newshape=(n, 1))
-        assert R_sum_ax1.shape == (n, 1)
-
-        # Divide each element in R by
-        return R/R_sum_ax1
+        if out is None:
+            out = np.empty((n, self.C))
+        assert out.shape == (n, self.C), "out has shape {}".format(out.shape)
+        P = self.shifted_scores(X, out)
+        np.exp(P, out=P)
+        P /= P.sum(axis=1)[:, np.newaxis]
+        return P
 
     def predict(self):
         """
         Produce an array of class predictions
         """
-        probabilities = self.probability_array(self.X)
+        probabilities = self.probability_array(
+            self.X, out=self.score_buffer(self.N))
         # THIS ASSUMES the classifiers are in order: 0th column of the
         # probabilities corresponds to label = 0, ..., 9th col is for 9.
         classes = np.argmax(probabilities, axis=1)
         return classes
 
-    def log_loss(self, X, Y):
-        probabilities = self.probability_array(X).copy()
-        # get just the probability for the correct label.
-        probabilities = np.multiply(Y, probabilities)
-        # collapse it into an Nx1 array:
-        probabilities = np.amax(probabilities, axis=1)
+    def log_loss(self, X, Y, y=None):
+        """
+        Sum of log(probability of the correct label), via
+        log p_i = (q_i,y_i - max_j q_ij) - log(sum_j exp(q_ij - max_j q_ij)).
+        Picks out the correct label's score by index, so there's no n x C
+        mask multiply, and never takes the log of an underflowed 0.
 
-        return np.log(probabilities).sum()
+        :param y: labels (n, ) or (n, 1).  Found from one-hot Y if None.
+        """
+        n = X.shape[0]
+        labels = np.argmax(Y, axis=1) if y is None else y
+        labels = np.ravel(np.asarray(labels)).astype(int)
+        scores = self.shifted_scores(X, self.score_buffer(n))
+        correct = scores[np.arange(n), labels]
+        np.exp(scores, out=scores)
+        return (correct - np.log(scores.sum(axis=1))).sum()
 
     def step(self, X, Y):
         """
@@ -91,17 +176,53 @@ class LogisticRegression(ClassificationBase):
         """
         n, d = X.shape
         assert n == Y.shape[0]
-        P = self.probability_array(X)
-        E = Y - P  # prediction error for each class (column). (0 to 1)
-
-        # TODO: scale eta by batch size.
-        self.W += (self.eta/self.N)*(-self.lam_norm*self.W + X.T.dot(E)/n)
+        P = self.probability_array(X, out=self.score_buffer(n))
+        self.update_loss_ema(P, Y)
+        P -= Y  # -(prediction error) for each class (column). (0 to 1)
+
+        # gradient of the (normalized) regularized negative log loss
+        gradient = X.T.dot(P)/n
+        gradient += self.lam_norm*self.W
+        self.optimizer.update(self.W, gradient, lr=self.learning_rate())
         assert self.W.shape == (self.d ,self.C), \
             "shape of W is {}".format(self.W.shape)
         self.steps += 1
 
-    def shrink_eta(self, s, s_exp=0.5):
+    def update_loss_ema(self, P, Y):
+        """
+        Fold this minibatch's -(log loss)/n into a moving average.  The
+        probabilities were already computed for the step, so it's ~free.
+        """
+        n = P.shape[0]
+        p_correct = P[np.arange(n), np.argmax(Y, axis=1)]
+        batch_loss = -np.log(np.maximum(p_correct, np.finfo(P.dtype).tiny))
+        batch_loss = batch_loss.sum()/n
+        if self.minibatch_loss_ema is None:
+            self.minibatch_loss_ema = batch_loss
+        else:
+            self.minibatch_loss_ema = self.loss_ema_decay*\
+                self.minibatch_loss_ema + (1 - self.loss_ema_decay)*batch_loss
+
+    def estimate_neg_log_loss_norm(self):
+        """
+        -(log loss)/N on the monitoring rows.  Exact if they're all of X.
+        """
+        X, Y, y = self.monitoring_data()
+        return -self.log_loss(X, Y, y)/X.shape[0]
 
+    def learning_rate(self):
+        """
+        The step size handed to the optimizer: eta/N for SGD and momentum
+        (TODO: scale eta by batch size), the raw eta0 for adaptive ones.
+        """
+        if self.optimizer.adaptive:
+            return self.eta0
+        return self.eta/self.N
+
+    def shrink_eta(self, s, s_exp=0.5):
+        # adaptive optimizers shrink their own steps.
+        if self.optimizer.adaptive:
+            return
         self.eta = self.eta0/(s**s_exp)
 
     def results_row(self):
@@ -111,27 +232,87 @@ class LogisticRegression(ClassificationBase):
         results_row = super(LogisticRegression, self).results_row()
 
         # append on logistic regression-specific results
-        neg_log_loss = -self.log_loss(self.X, self.Y)
+        neg_log_loss = -self.log_loss(self.X, self.Y, self.y)
         more_details = {
             "lambda":[self.lam],
             "lambda normalized":[self.lam_norm],
             "eta0":[self.eta0],
             "eta": [self.eta],  # learning rate
-            "log loss": [self.log_loss(self.X, self.Y)],
+            "log loss": [-neg_log_loss],
             "-(log loss), training": [neg_log_loss],
             "-(log loss)/N, training": [neg_log_loss/self.N],
             "step": [self.steps],
             "batch size": [self.batch_size],
+            "points sampled": [self.points_sampled],
+            "training seconds": [self.training_seconds],
+            "samples/second": [self.samples_per_second()],
             "# of passes through N pts": [self.num_passes_through_N_pts]
             }
         results_row.update(more_details)
+        results_row.update(self.optimizer.info())
         return results_row
 
+    def samples_per_second(self):
+        """
+        Training throughput so far.  Only time spent stepping counts, so
+        batch sizes can be compared on wall-clock-to-target-loss.
+        """
+        if self.training_seconds == 0:
+            return np.nan
+        return self.points_sampled/self.training_seconds
+
+    def add_training_time(self, start):
+        """
+        Add the time since start to the training clock; return now.
+        """
+        now = datetime.datetime.now()
+        self.training_seconds += (now - start).total_seconds()
+        return now
+
     def record_status(self):
         results_row = self.results_row()
         results_row['minibatches tested'] = [self.num_passes_through_N_pts]
         return results_row
 
+    def record_estimated_status(self):
+        """
+        A cheap results row: the sampled loss estimate and the minibatch
+        loss EMA, but no 0/1 loss, weight copy, or test data evaluation.
+        """
+        return {
+            "lambda": [self.lam],
+            "eta0": [self.eta0],
+            "eta": [self.eta],
+            "step": [self.steps],
+            "batch size": [self.batch_size],
+            "points sampled": [self.points_sampled],
+            "training seconds": [self.training_seconds],
+            "samples/second": [self.samples_per_second()],
+            "# of passes through N pts": [self.num_passes_through_N_pts],
+            "minibatches tested": [self.num_passes_through_N_pts],
+            "-(log loss)/N, training estimate":
+                [self.estimate_neg_log_loss_norm()],
+            "minibatch -(log loss)/n, EMA": [self.minibatch_loss_ema]
+        }
+
+    def monitor_progress(self):
+        """
+        Add a row to self.results.  Full train + test evaluation on every
+        full_eval_every-th call, the sampled estimate otherwise.
+        """
+        self.monitoring_checks += 1
+        if self.monitoring_checks%self.full_eval_every != 0:
+            row_results = pd.DataFrame(self.record_estimated_status())
+        else:
+            row_results = pd.DataFrame(self.record_status())
+            row_results["minibatch -(log loss)/n, EMA"] = \
+                self.minibatch_loss_ema
+            # also find the log loss & 0/1 loss using test data.
+            if self.test_X is not None:
+                test_results = self.assess_model_on_test_data()
+                row_results = pd.merge(row_results, test_results)
+        self.results = pd.concat([self.results, row_results])
+
     def assess_model_on_test_data(self):
         test_results = pd.DataFrame(
             self.apply_model(X=self.test_X, y=self.test_y,
@@ -145,51 +326,47 @@ class LogisticRegression(ClassificationBase):
         num_diverged_steps = 0
         fast_convergence_steps = 0
 
+        # Reshuffled every pass, without copying X and Y.
+        minibatches = MinibatchIterator(self.X, self.Y, self.batch_size)
+
+        # Loss before the first pass.  After that, each pass starts from
+        # the loss the previous pass ended with.
+        new_neg_log_loss_norm = self.estimate_neg_log_loss_norm()
+
         # Step until converged
         for s in range(1, self.max_steps+1):
             if self.verbose:
                 print('loop through all the data. {}th time'.format(s))
-            # Shuffle each time we loop through the entire data set.
-            X, Y = self.shuffle(self.X, self.Y)
 
             num_pts = 0  # initial # of points seen in this pass through N pts
             # record status of log_loss before loop.
+            old_neg_log_loss_norm = new_neg_log_loss_norm
 
-            # Don't compute loss every time; expensive!
-            # TODO: move this into the loop below and get log_loss from the
-            # Pandas result so I don't compute it extra times.  (Expensive!)
-            old_neg_log_loss_norm = -self.log_loss(self.X, self.Y)/self.N
-
-            # loop over ~all of the data points in little batches.
-            while num_pts < self.N:
-                idx_start = 0
-                idx_stop = self.batch_size
-                # TODO: what happens if you split training data and you ask fo'
-                # more data then there is?   
-                X_sample = X[idx_start:idx_stop, ]
-                Y_sample = Y[idx_start:idx_stop, ]
+            # loop over all of the data points in little batches.
+            clock_start = datetime.datetime.now()
+            for X_sample, Y_sample in minibatches:
                 self.step(X_sample, Y_sample)
-                num_pts += self.batch_size
-                self.points_sampled += self.batch_size
+                num_pts += X_sample.shape[0]
+                self.points_sampled += X_sample.shape[0]
 
                 # Take the pulse once and a while, but not too much.
-                if self.points_sampled%self.progress_monitoring_freq == 0:
-                    # TODO: move all log-loss checking down here. Break out
-                    # another function like .assess_progress()?
-                    training_results = self.record_status()
-                    # print(self.log_loss(self.X, self.Y))
-                    training_results = pd.DataFrame(training_results)
-                     # also find the log loss & 0/1 loss using test data.
-                    test_results = self.assess_model_on_test_data()
-                    row_results = pd.merge(training_results, test_results)
-                    self.results = pd.concat([self.results, row_results])
-
+                # (The last batch of a pass can be short, so check whether
+                # we crossed a multiple of the monitoring frequency.)
+                if self.points_sampled//self.progress_monitoring_freq > \
+                        (self.points_sampled - X_sample.shape[0])//\
+                        self.progress_monitoring_freq:
+                    self.add_training_time(clock_start)
+                    self.monitor_progress()
+                    # don't bill the monitoring to training throughput.
+                    clock_start = datetime.datetime.now()
+
+            self.add_training_time(clock_start)
             s+=1
             self.num_passes_through_N_pts +=1
             sys.stdout.write(".") # one dot per pass through ~ N pts
 
             # print every 5th pass through all N-ish data points
-            new_neg_log_loss_norm = self.results_row()['-(log loss)/N, training'][0]
+            new_neg_log_loss_norm = self.estimate_neg_log_loss_norm()
             if self.verbose:
                 if s%10%self.batch_size == 0: print(new_neg_log_loss_norm)
 
@@ -208,7 +385,7 @@ class LogisticRegression(ClassificationBase):
             else:
                 num_diverged_steps = 0
             if num_diverged_steps == 10:
-                raise ModelFitExcpetion("log loss grew 10 times in a row!")
+                raise ModelFitException("log loss grew 10 times in a row!")
 
             assert not self.has_increased_significantly(
                 old_neg_log_loss_norm, new_neg_log_loss_norm),\
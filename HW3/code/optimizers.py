@@ -0,0 +1,178 @@
+import copy
+import numpy as np
+
+
+class SGD:
+    """
+    Plain stochastic gradient descent: W <-- W - lr*gradient.
+
+    Every optimizer updates W in place, given the gradient and a step
+    size from the model.  State buffers are allocated on the first update,
+    in W's shape, and reused after that.
+
+    Step sizes: optimizers with adaptive = False (SGD, Momentum) get the
+    model's usual eta, scaled the model's way (eta/N for
+    LogisticRegression, eta/batch size for LeastSquaresSGD) and shrunk
+    by shrink_eta, so eta0 means what it always has (e.g. what
+    LeastSquaresSGD's eta0 search finds).  Adaptive ones (AdaGrad, Adam)
+    normalize the gradient themselves, so they get the raw eta0, held
+    constant, in both models.
+    """
+    name = 'sgd'
+    adaptive = False
+    default_eta0 = None  # no scale-free default; search or pass eta0
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything learned about past gradients.
+        """
+        self.updates = 0
+
+    def fresh(self):
+        """
+        A new optimizer with the same settings and no state, so copied
+        models don't share buffers.
+        """
+        optimizer = copy.copy(self)
+        optimizer.reset()
+        return optimizer
+
+    def buffer(self, W):
+        return np.zeros_like(W, dtype=np.result_type(W, float))
+
+    def update(self, W, gradient, lr):
+        W -= lr*gradient
+        self.updates += 1
+
+    def info(self):
+        return {'optimizer': [self.name]}
+
+
+class Momentum(SGD):
+    """
+    Heavy-ball momentum, or Nesterov's accelerated gradient.
+
+    v <-- mu*v - lr*gradient; then W <-- W + v, or for Nesterov,
+    W <-- W + mu*v - lr*gradient (the look-ahead written in terms of the
+    gradient at the current W, so no second gradient evaluation).
+
+    Uses the same (scaled, shrinking) eta0 as SGD; with mu = 0.9 the
+    effective step is ~10x larger, so start from about eta0_SGD/10.
+    """
+    def __init__(self, mu=0.9, nesterov=False):
+        self.mu = mu
+        self.nesterov = nesterov
+        self.name = 'nesterov' if nesterov else 'momentum'
+        super(Momentum, self).__init__()
+
+    def reset(self):
+        super(Momentum, self).reset()
+        self.velocity = None
+
+    def update(self, W, gradient, lr):
+        if self.velocity is None:
+            self.velocity = self.buffer(W)
+        v = self.velocity
+        v *= self.mu
+        v -= lr*gradient
+        if self.nesterov:
+            W += self.mu*v
+            W -= lr*gradient
+        else:
+            W += v
+        self.updates += 1
+
+    def info(self):
+        info = super(Momentum, self).info()
+        info['momentum'] = [self.mu]
+        return info
+
+
+class AdaGrad(SGD):
+    """
+    Per-weight step sizes: lr/sqrt(sum of that weight's squared gradients).
+
+    Gets the raw eta0, not scaled by N or the batch size, and no
+    shrink_eta (the growing sum already shrinks the steps).  Each weight
+    moves ~eta0 on its first steps; eta0 in 1e-3 to 1e-1, default 1e-2.
+    """
+    name = 'adagrad'
+    adaptive = True
+    default_eta0 = 1e-2
+
+    def __init__(self, eps=1e-8):
+        self.eps = eps
+        super(AdaGrad, self).__init__()
+
+    def reset(self):
+        super(AdaGrad, self).reset()
+        self.G = None  # running sum of squared gradients
+        self.work = None
+
+    def update(self, W, gradient, lr):
+        if self.G is None:
+            self.G = self.buffer(W)
+            self.work = self.buffer(W)
+        self.G += np.square(gradient, out=self.work)
+        step = np.sqrt(self.G, out=self.work)
+        step += self.eps
+        np.divide(gradient, step, out=step)
+        step *= lr
+        W -= step
+        self.updates += 1
+
+
+class Adam(SGD):
+    """
+    Adam: momentum on the gradient, scaled per weight by a moving average
+    of the squared gradient, both bias-corrected for the early steps.
+
+    Gets the raw eta0, not scaled by N or the batch size, and no
+    shrink_eta.  Each weight moves at most ~eta0 per step, whatever the
+    gradient's scale; eta0 in 1e-4 to 1e-2, default 1e-3.
+    """
+    name = 'adam'
+    adaptive = True
+    default_eta0 = 1e-3
+
+    def __init__(self, beta1=0.9, beta2=0.999, eps=1e-8):
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        super(Adam, self).__init__()
+
+    def reset(self):
+        super(Adam, self).reset()
+        self.m = None  # first moment
+        self.v = None  # second moment
+        self.work = None
+
+    def update(self, W, gradient, lr):
+        if self.m is None:
+            self.m = self.buffer(W)
+            self.v = self.buffer(W)
+            self.work = self.buffer(W)
+        self.updates += 1
+        t = self.updates
+
+        self.m *= self.beta1
+        self.m += (1 - self.beta1)*gradient
+        self.v *= self.beta2
+        self.v += (1 - self.beta2)*np.square(gradient, out=self.work)
+
+        # fold both bias corrections into the step size
+        lr_t = lr*np.sqrt(1 - self.beta2**t)/(1 - self.beta1**t)
+        step = np.sqrt(self.v, out=self.work)
+        step += self.eps
+        np.divide(self.m, step, out=step)
+        step *= lr_t
+        W -= step
+
+    def info(self):
+        info = super(Adam, self).info()
+        info['beta1'] = [self.beta1]
+        info['beta2'] = [self.beta2]
+        return info